@@ -1,156 +1,326 @@
 import sys
 import itertools
 import argparse
-from gurobipy import *
+from array import array
 
 from tree import *
+from cache import cached_normal_forms
+from certificate import write_certificate
+from core import find_core
+from index import TreeIndex
+from constraints import emit
+from model import Model
+from solvers import SOLVERS, get_solver
+from parallel import map_shards, rows
+from presolve import unanimity, different_orbits, pareto_on_triples, violated_rules_shard, filter_triples, presolve, write_log, summary
+import instrumentation
+import memo
+
+
+# The following functions compute shards of the model in worker processes (see parallel.py).
+# Variables are encoded by their index in the list of possible meets.
+# If the state contains the values of the variables in a solution (an array), only the
+# constraints violated by the solution are encoded.
+
+def transitivity_shard(state, start, end):
+    """
+    Encode the transitivity constraints of the pairs (t,r) in [start, end), as triples of variables
+    (t <= r, r <= s, t <= s), where the last one is -1 if t <= s is not possible.
+    """
+    index = state['index']
+    p = state['p']
+    values = state.get('values')
+    res = array('i')
+    
+    for t, r in state['pairs'][start:end]:
+        if values is not None and not values[p[t,r]]:
+            continue
+        for s in state['trees']:
+            rs = index.normalize((r,s))
+            if rs in p:
+                ts = p.get(index.normalize((t,s)), -1)
+                if values is None or values[p[rs]] and (ts == -1 or not values[ts]):
+                    res.extend((p[t,r], p[rs], ts))
+    
+    return res
+
+
+def meet_shard(state, start, end):
+    """
+    Encode the meet constraints t = r^s, u <= r, u <= s => u <= t of the possible meets in [start, end),
+    as quadruples of variables (t = r^s, u <= r, u <= s, u <= t), where the last one is -1
+    if u <= t is not possible.
+    """
+    index = state['index']
+    p = state['p']
+    values = state.get('values')
+    res = array('i')
+    
+    for i in range(start, end):
+        if values is not None and not values[i]:
+            continue
+        t, r, s = state['possible_meets'][i]
+        for u in state['trees']:
+            ur = index.normalize((u,r))
+            if ur in p:
+                us = index.normalize((u,s))
+                if us in p:
+                    ut = p.get(index.normalize((u,t)), -1)
+                    if values is None or values[p[ur]] and values[p[us]] and (ut == -1 or not values[ut]):
+                        res.extend((i, p[ur], p[us], ut))
+    
+    return res
+
+
+def transitivity_constraints(state, processes=1):
+    """
+    Generate the constraints t <= r, r <= s imply t <= s.
+    """
+    possible_meets = state['possible_meets']
+    for tr, rs, ts in rows(map_shards(transitivity_shard, state, len(state['pairs']), processes=processes), 3):
+        yield [(1, possible_meets[tr]), (1, possible_meets[rs])] + ([(-1, possible_meets[ts])] if ts >= 0 else []), '<=', 1
+
+
+def meet_constraints(state, processes=1):
+    """
+    Generate the constraints t = r^s, u <= r, u <= s imply u <= t.
+    """
+    possible_meets = state['possible_meets']
+    for trs, ur, us, ut in rows(map_shards(meet_shard, state, len(possible_meets), processes=processes), 4):
+        yield [(1, possible_meets[trs]), (1, possible_meets[ur]), (1, possible_meets[us])] + ([(-1, possible_meets[ut])] if ut >= 0 else []), '<=', 2
+
+
+def violated_constraints(state, solution, processes=1):
+    """
+    Transitivity and meet3 constraints violated by a solution (the set of variables with value 1),
+    as a list of pairs (family name, list of constraints). See Solver.solve_lazily.
+    """
+    state['values'] = array('b', (triple in solution for triple in state['possible_meets']))
+    try:
+        return [
+            ("trans", list(transitivity_constraints(state, processes))),
+            ("meet3", list(meet_constraints(state, processes))),
+        ]
+    finally:
+        del state['values']
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Find a regular consensus method that is associative and Pareto on rooted triples.')
     
-    parser.add_argument('n', nargs='?', default=3, type=int, choices=[3,4,5], help='number of leaves (between 3 and 5, default 3)')
-    parser.add_argument('-t', '--threads', default=1, type=int, help='number of threads that can be used')
+    parser.add_argument('n', nargs='?', default=3, type=int, choices=[3,4,5,6], help='number of leaves (between 3 and 6, default 3)')
+    parser.add_argument('-t', '--threads', default=1, type=int, help='number of threads (and processes) that can be used')
+    parser.add_argument('--recompute', action='store_true', help='recompute normal forms instead of loading them from the cache')
+    parser.add_argument('-s', '--solver', default='gurobi', choices=sorted(SOLVERS), help='solver to use (default gurobi)')
+    parser.add_argument('--presolve', action='store_true', help='fix the variables forced by propagation of the constraints, and remove them from the model')
+    parser.add_argument('--presolve-log', metavar='FILE', help='write the log of eliminated variables to a file')
+    parser.add_argument('--lp', metavar='FILE', help='write the model to an LP file instead of solving it')
+    parser.add_argument('--mps', metavar='FILE', help='write the model to an MPS file instead of solving it')
+    parser.add_argument('--cnf', metavar='FILE', help='write the model to a DIMACS CNF file instead of solving it')
+    parser.add_argument('--lazy', action='store_true', help='add the transitivity and meet3 constraints only when violated by a solution')
+    parser.add_argument('--certificate', metavar='FILE', help='write the consensus method found (or the infeasibility of the model) to a certificate file, which can be checked with verify.py')
+    parser.add_argument('--core', metavar='FILE', help='if there is no valid consensus method, find an irreducible infeasible subset of the constraints (testing up to --threads removals at a time) and write it to a file')
+    parser.add_argument('--cache-limit', metavar='ENTRIES', type=int, help='maximum number of entries of each in-memory cache of normal forms and clusters (default no limit)')
+    parser.add_argument('--trace', metavar='FILE', help='write a trace of the phases of the run (time, memory, counters) to a file in Chrome trace format')
     args = parser.parse_args()
+    
+    if args.lazy and (args.presolve or args.lp or args.mps or args.cnf):
+        parser.error("--lazy cannot be used with --presolve, --lp, --mps, --cnf")
+    if args.lazy and args.core:
+        parser.error("--lazy cannot be used with --core")
 
 
+    if args.trace is not None:
+        instrumentation.start(args.trace)
+    memo.set_limit(args.cache_limit)
+    
     n = args.n
-    print "n =", n
-    X = range(1, n+1)
-    print "X =", X
+    print("n =", n)
+    X = list(range(1, n+1))
+    print("X =", X)
     
-    trees = list(all_trees(X))
+    print("Compute normal forms of tuples of trees")
+    instrumentation.phase("normal forms")
+    trees, normal_trees, normal_pairs, normal_triples = cached_normal_forms(n, processes=args.threads, refresh=args.recompute)
+    print()
     
-    print "Compute normal forms of tuples of trees"
-    normal_trees, normal_pairs, normal_triples = find_normal_forms(X, processes=args.threads)
-    print
+    print("There are %d trees, %d normal trees, %d normal pairs, and %d normal triples" % (len(trees), len(normal_trees), len(normal_pairs), len(normal_triples)))
     
-    print "There are %d trees, %d normal trees, %d normal pairs, and %d normal triples" % (len(trees), len(normal_trees), len(normal_pairs), len(normal_triples))
+    instrumentation.count(trees=len(trees), normal_trees=len(normal_trees), normal_pairs=len(normal_pairs), normal_triples=len(normal_triples))
     
-    print "Find possible meets"
-    possible_meets = []
-    for triple in normal_triples:
-        t, r, s = triple
-        
-        if r == s and t != r:
-            # (t,r,r) is possible only for t=r
-            continue
-        
-        if t != r and normalize_tree(t) == normalize_tree(r):
-            # t < r is not possible if t and r are in the same orbit
-            continue
-        
-        if t != s and normalize_tree(t) == normalize_tree(s):
-            # t < s is not possible if t and s are in the same orbit
-            continue
-        
-        possible = True
-        for Y in itertools.combinations(X, 3):
-            u = restriction(r, Y)
-            if len(u) < 3:  # u is not the bottom element
-                if restriction(s, Y) == u and restriction(t, Y) != u:
-                    possible = False
-                    break
-        
-        if possible:
-            possible_meets.append(triple)
+    print("Index trees")
+    instrumentation.phase("index")
+    # from now on, trees are represented by their IDs
+    index = TreeIndex(n, cached=True, refresh=args.recompute)
+    trees = [index.ids[t] for t in trees]
+    normal_trees = [index.ids[t] for t in normal_trees]
+    normal_pairs = [index.encode(pair) for pair in normal_pairs]
+    normal_triples = [index.encode(triple) for triple in normal_triples]
     
+    print("Normalize pairs of trees")
+    # the normal forms of pairs are shared with the worker processes
+    index.share_pair_table(processes=args.threads)
     
-    print "There are %d possible meets" % len(possible_meets)
+    print("Find possible meets")
+    instrumentation.phase("possible meets")
+    log = []
+    rules = [unanimity, different_orbits, pareto_on_triples]
+    for Y in itertools.combinations(X, 3):
+        index.restriction_table(leaves_to_mask(Y))
     
-    ### create optimization model ###
-    model = Model('phylogenetictrees')
+    # state shared with the worker processes
+    state = {
+        'index': index,
+        'trees': trees,
+        'triples': normal_triples,
+        'rules': rules,
+    }
+    violated = itertools.chain.from_iterable(map_shards(violated_rules_shard, state, len(normal_triples), processes=args.threads, typecode='b'))
+    possible_meets = filter_triples(normal_triples, violated, rules, log)
     
-    print "Create variables"
-    # m[t,r,s] == 1 means that t is the meet of r and s
+    print("There are %d possible meets" % len(possible_meets))
+    instrumentation.count(possible_meets=len(possible_meets))
+    for reason, count in sorted(summary(log).items()):
+        print("  %d triples excluded by %s" % (count, reason))
     
-    m = model.addVars(possible_meets, name="m", vtype=GRB.BINARY)
+    ### create optimization model ###
+    print("Create variables")
+    instrumentation.phase("variables")
+    # m[t,r,s] == 1 means that t is the meet of r and s
+    model = Model('phylogenetictrees', possible_meets, prefix='m')
     
     # p[t,r] == 1 means that t <= r
+    # this is the variable of the triple (t,t,r)
+    variables = {triple: i for i, triple in enumerate(possible_meets)}
     p = {}
     for t, r in normal_pairs:
-        triple = normalize_tuple((t,t,r))
-        if triple in m:
-            p[t,r] = m[triple]
+        triple = index.normalize((t,t,r))
+        if triple in variables:
+            p[t,r] = triple
+    
+    state['possible_meets'] = possible_meets
+    state['pairs'] = list(p)
+    state['p'] = {pair: variables[triple] for pair, triple in p.items()}
     
     
-    print "Add poset constraints"
-    print "* Reflexive"
-    model.addConstrs((p[t,t] == 1 for t in normal_trees), "refl")
+    print("Add poset constraints")
+    instrumentation.phase("poset constraints")
+    print("* Reflexive")
+    emit(model, "refl", (([(1, p[t,t])], '==', 1) for t in normal_trees))
     
-    print "* Antisymmetric"
-    model.addConstrs((p[t,r] + p[normalize_tuple((r,t))] <= 1 for (t,r) in p if normalize_tuple((r,t)) in p and t != r), "antisym")
+    print("* Antisymmetric")
+    emit(model, "antisym", (
+        ([(1, p[t,r]), (1, p[index.normalize((r,t))])], '<=', 1) \
+        for (t,r) in p if index.normalize((r,t)) in p and t != r
+    ))
     
-    print "* Transitive"
-    model.addConstrs((
-        (p[normalize_tuple((t,s))] if normalize_tuple((t,s)) in p else 0) \
-        >= p[t,r] + p[normalize_tuple((r,s))] - 1 \
-        for (t,r) in p for s in trees \
-        if normalize_tuple((r,s)) in p
-    ), "trans")
+    if not args.lazy:
+        print("* Transitive")
+        # t <= r, r <= s imply t <= s
+        emit(model, "trans", transitivity_constraints(state, processes=args.threads))
     
     
-    print "Add meet constraints"
+    print("Add meet constraints")
+    instrumentation.phase("meet constraints")
     
     # r^s <= r
-    model.addConstrs((
-        p[normalize_tuple((t,r))] >= m[t,r,s] \
+    emit(model, "meet1", (
+        ([(1, (t,r,s)), (-1, p[index.normalize((t,r))])], '<=', 0) \
         for (t,r,s) in possible_meets
-    ), "meet1")
+    ))
     
     # r^s <= s
-    model.addConstrs((
-        p[normalize_tuple((t,s))] >= m[t,r,s] \
+    emit(model, "meet2", (
+        ([(1, (t,r,s)), (-1, p[index.normalize((t,s))])], '<=', 0) \
         for (t,r,s) in possible_meets
-    ), "meet2")
-    
-    # t = r^s, u <= r, u <= s imply u <= t
-    # the triple (t,r,s) is in the list of possible meets
-    model.addConstrs((
-        m[t,r,s] + \
-        p[normalize_tuple((u,r))] + \
-        p[normalize_tuple((u,s))] - \
-        (p[normalize_tuple((u,t))] if normalize_tuple((u,t)) in p else 0) \
-        <= 2 
-        for (t,r,s) in possible_meets for u in trees \
-        if normalize_tuple((u,r)) in p and normalize_tuple((u,s)) in p
-    ), "meet3")
-    
-    
-    print "Force that every (normal) pair has a meet"
+    ))
+    
+    if not args.lazy:
+        # t = r^s, u <= r, u <= s imply u <= t
+        # the triple (t,r,s) is in the list of possible meets
+        emit(model, "meet3", meet_constraints(state, processes=args.threads))
+    
+    
+    print("Force that every (normal) pair has a meet")
+    instrumentation.phase("meetexists constraints")
     matching = {(r,s): set() for (r,s) in normal_pairs}
     for (t,r,s) in possible_meets:
-        matching[normalize_tuple((r,s))].add((t,r,s))
+        matching[index.normalize((r,s))].add((t,r,s))
         if r != s:
-            matching[normalize_tuple((s,r))].add((t,r,s))
+            matching[index.normalize((s,r))].add((t,r,s))
     
-    model.addConstrs((
-        sum(m[triple] for triple in matching[pair]) == 1 for pair in matching
-    ), "meetexists")
+    emit(model, "meetexists", (
+        ([(1, triple) for triple in sorted(matching[pair])], '==', 1) for pair in matching
+    ))
     
+    # the core is found among the constraints of the whole model
+    whole_model = model
+    fixed = {}
+    if args.presolve:
+        print("Presolve")
+        instrumentation.phase("presolve")
+        num_excluded = len(log)
+        model, fixed = presolve(model, log)
+        for reason, count in sorted(summary(log[num_excluded:]).items()):
+            print("  %d variables fixed by %s" % (count, reason))
     
-    ### solve ###
-    kwargs = {
-        "Threads": args.threads,
-        "PoolSearchMode": 2,
-        "PoolSolutions": 2, # try to find 2 solutions
-    }
+    if args.presolve_log is not None:
+        write_log(args.presolve_log, log, index.decode)
+    
+    if model is None:
+        print()
+        print("There is no valid consensus method for X = %r (found by presolve: %s)" % (X, log[-1][2]))
+        if args.certificate is not None:
+            write_certificate(args.certificate, 'associative', n, None)
+        if args.core is not None:
+            find_core(whole_model, range(len(whole_model)), get_solver(args.solver), args.core, index.decode, threads=args.threads)
+        sys.exit(0)
     
-    for (arg, val) in kwargs.iteritems():
-        model.setParam(arg, val)
+    if args.presolve:
+        print("%d variables fixed, %d variables and %d constraints left" % (len(fixed), len(model.variables), len(model)))
     
-    model.optimize()
+    if args.lp is not None or args.mps is not None or args.cnf is not None:
+        instrumentation.phase("write model")
+        if args.lp is not None:
+            model.write_lp(args.lp)
+            print("Model written to %s" % args.lp)
+        if args.mps is not None:
+            model.write_mps(args.mps)
+            print("Model written to %s" % args.mps)
+        if args.cnf is not None:
+            model.write_cnf(args.cnf)
+            print("Model written to %s" % args.cnf)
+        sys.exit(0)
+    
+    
+    ### solve ###
+    instrumentation.phase("solve")
+    instrumentation.count(variables=len(model.variables), constraints=len(model), caches=memo.statistics())
+    if args.lazy:
+        # transitivity and meet3 constraints are added when violated
+        separate = lambda solution, processes: violated_constraints(state, solution, processes=processes)
+        solutions = get_solver(args.solver).solve_lazily(model, separate, threads=args.threads, solutions=2)
+    else:
+        solutions = get_solver(args.solver).solve(model, threads=args.threads, solutions=2)  # try to find 2 solutions
+
+    # add the variables fixed to 1 by presolve
+    ones = set(var for var, value in fixed.items() if value == 1)
+    solutions = [solution | ones for solution in solutions]
 
-    print
-    if model.Status == GRB.INFEASIBLE:
-        print "There is no valid consensus method for X = %r" % X
+    print()
+    if len(solutions) == 0:
+        print("There is no valid consensus method for X = %r" % X)
 
     else:
-        print "Found consensus method for X = %r:" % X
-        for (t,r), v in p.iteritems():
-            if v.x > 0.5:
-                print "%r <= %r" % (t,r)
+        print("Found consensus method for X = %r:" % X)
+        for (t,r), triple in p.items():
+            if triple in solutions[0]:
+                print("%r <= %r" % index.decode((t,r)))
         
-        if model.SolCount == 1:
-            print "This solution is unique"
+        if len(solutions) == 1:
+            print("This solution is unique")
 
+    if args.certificate is not None:
+        write_certificate(args.certificate, 'associative', n, [index.decode(triple) for triple in solutions[0]] if len(solutions) > 0 else None)
+    if args.core is not None and len(solutions) == 0:
+        find_core(whole_model, range(len(whole_model)), get_solver(args.solver), args.core, index.decode, threads=args.threads)
@@ -0,0 +1,246 @@
+"""
+Benchmarks of the primitives of tree.py and of the construction of the models of
+associative.py and extension.py.
+
+Every benchmark runs in a new process, so that it starts with empty caches and its
+peak memory usage (maximum resident set size) is its own. For the primitives, the
+sizes of the caches of tree.py at the end are recorded too; for the models, the
+number of constraints of every family and the time taken to generate it.
+Results are written to a JSON file, which can be compared with the results of a
+previous run (e.g. on another commit) to find regressions.
+"""
+
+import os
+import re
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import resource
+import subprocess
+from collections import OrderedDict
+from multiprocessing import Pool, TimeoutError
+
+import tree
+import memo
+from tree import *
+from cache import cached_normal_forms
+
+
+# number of random tuples used by the benchmarks of normalize_tuple and compare
+SAMPLE_SIZE = 10000
+
+
+def sample_tuples(X, arity, size=SAMPLE_SIZE):
+    """
+    Random tuples of trees on X, the same ones in every run.
+    """
+    trees = list(all_trees(X))
+    rng = random.Random(len(X))
+    return [tuple(rng.choice(trees) for i in range(arity)) for j in range(size)]
+
+
+# A benchmark does its setup, and returns a function which does the measured work and
+# returns the number of items processed.
+
+def bench_all_trees(X):
+    return lambda: sum(1 for t in all_trees(X))
+
+
+def bench_all_tree_masks(X):
+    return lambda: sum(1 for masks in all_trees(X, encoding='masks'))
+
+
+def bench_set_partitions(X):
+    return lambda: sum(1 for p in set_partitions(X))
+
+
+def bench_normalize_tree(X):
+    trees = list(all_trees(X))
+    return lambda: len(set(normalize_tree(t) for t in trees))
+
+
+def bench_normalize_tuple(X):
+    tuples = sample_tuples(X, 2) + sample_tuples(X, 3)
+    return lambda: len(set(normalize_tuple(tup) for tup in tuples))
+
+
+def bench_find_normal_forms(X):
+    return lambda: sum(len(forms) for forms in find_normal_forms(X))
+
+
+def bench_restriction(X):
+    trees = list(all_trees(X))
+    subsets = [Y for Y in powerset(X) if len(Y) > 0]
+    return lambda: sum(1 for t in trees for Y in subsets if restriction(t, Y) is not None)
+
+
+def bench_compare(X):
+    pairs = sample_tuples(X, 2)
+    return lambda: sum(1 for t, s in pairs if compare(t, s))
+
+
+def script_benchmark(script, binary=False):
+    """
+    Benchmark of the construction of the model of a script, which is written to an
+    empty LP file. The normal forms used by the script (of the profiles of binary trees
+    only, if binary is True) are computed (or loaded) before.
+    """
+    def bench(X):
+        cached_normal_forms(len(X), binary=binary)
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), script), str(len(X)), '--lp', os.devnull]
+        
+        def run():
+            output = subprocess.check_output(command, universal_newlines=True)
+            # lines printed by emit
+            families = re.findall(r"^  (\S+): (\d+) constraints in ([\d.]+) seconds", output, re.MULTILINE)
+            return OrderedDict((name, {'constraints': int(count), 'seconds': float(seconds)}) for name, count, seconds in families)
+        return run
+    return bench
+
+
+BENCHMARKS = OrderedDict([
+    ('all_trees', bench_all_trees),
+    ('all_tree_masks', bench_all_tree_masks),
+    ('set_partitions', bench_set_partitions),
+    ('normalize_tree', bench_normalize_tree),
+    ('normalize_tuple', bench_normalize_tuple),
+    ('find_normal_forms', bench_find_normal_forms),
+    ('restriction', bench_restriction),
+    ('compare', bench_compare),
+    ('associative_model', script_benchmark('associative.py')),
+    ('extension_model', script_benchmark('extension.py', binary=True)),
+])
+
+# maximum number of leaves of every benchmark: only the enumerations are fast enough
+# (and small enough in memory) for 8 leaves, the normal forms of all triples take minutes
+# for 6 leaves, and the scripts accept at most 6 leaves
+MAX_LEAVES = OrderedDict([
+    ('all_trees', 8),
+    ('all_tree_masks', 8),
+    ('set_partitions', 8),
+    ('normalize_tree', 7),
+    ('normalize_tuple', 7),
+    ('find_normal_forms', 6),
+    ('restriction', 7),
+    ('compare', 7),
+    ('associative_model', 6),
+    ('extension_model', 6),
+])
+
+
+def run_benchmark(name, n):
+    """
+    Run a benchmark in the current process, and return its result.
+    """
+    run = BENCHMARKS[name](list(range(1, n+1)))
+    start = time.time()
+    value = run()
+    seconds = time.time() - start
+    
+    result = OrderedDict([('benchmark', name), ('n', n), ('seconds', seconds)])
+    if isinstance(value, dict):
+        # the work was done by a subprocess
+        result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+        result['families'] = value
+    else:
+        result['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        result['count'] = value
+        result['cache_sizes'] = OrderedDict((cache, len(getattr(tree, cache))) for cache in ['CLUSTERS', 'NORMAL_TREES', 'NORMAL_TUPLES'])
+        result['cache_statistics'] = memo.statistics()
+    return result
+
+
+def run_in_new_process(name, n, timeout=None):
+    """
+    Run a benchmark in a new process. Return its result, or None if it takes longer than timeout seconds.
+    """
+    pool = Pool(processes=1)
+    try:
+        return pool.apply_async(run_benchmark, (name, n)).get(timeout if timeout is not None else 9999999)
+    except TimeoutError:
+        return None
+    finally:
+        pool.terminate()
+
+
+def commit():
+    """
+    Current git commit, if any.
+    """
+    try:
+        with open(os.devnull, 'w') as devnull:
+            return subprocess.check_output(['git', 'rev-parse', 'HEAD'], stderr=devnull, cwd=os.path.dirname(os.path.abspath(__file__)), universal_newlines=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare_results(old, new, tolerance):
+    """
+    Compare time and peak memory of the benchmarks in two runs.
+    Return the list of regressions, i.e. increases by more than the given fraction
+    (ignoring differences of less than 0.1 seconds or 1 MB).
+    """
+    floors = {'seconds': 0.1, 'peak_rss_kb': 1024}
+    old_results = {(result['benchmark'], result['n']): result for result in old['results']}
+    regressions = []
+    for result in new['results']:
+        key = (result['benchmark'], result['n'])
+        if key not in old_results or result.get('timeout') or old_results[key].get('timeout'):
+            continue
+        for measure, floor in sorted(floors.items()):
+            a, b = old_results[key][measure], result[measure]
+            if b > a * (1 + tolerance) and b - a > floor:
+                regressions.append((key[0], key[1], measure, a, b))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the primitives of tree.py and the construction of the models.')
+    
+    parser.add_argument('n', nargs='*', default=[3,4,5], type=int, choices=[3,4,5,6,7,8], help='numbers of leaves (between 3 and 8, default 3 4 5)')
+    parser.add_argument('-b', '--benchmark', action='append', choices=list(BENCHMARKS), help='benchmark to run (can be repeated; default all, skipping the ones for too many leaves)')
+    parser.add_argument('-o', '--output', metavar='FILE', default='benchmark.json', help='JSON file with the results (default benchmark.json)')
+    parser.add_argument('--timeout', type=float, help='stop a benchmark after this number of seconds')
+    parser.add_argument('--compare', metavar='FILE', help='JSON file with the results of a previous run, to find regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='fraction of increase of time or memory considered a regression (default 0.2)')
+    args = parser.parse_args()
+    
+    
+    results = []
+    for n in args.n:
+        for name in args.benchmark or list(BENCHMARKS):
+            if n > MAX_LEAVES[name]:
+                print("%-20s n=%d  skipped (at most %d leaves)" % (name, n, MAX_LEAVES[name]))
+                continue
+            result = run_in_new_process(name, n, args.timeout)
+            if result is None:
+                print("%-20s n=%d  timeout" % (name, n))
+                result = OrderedDict([('benchmark', name), ('n', n), ('timeout', True)])
+            else:
+                print("%-20s n=%d  %10.3f seconds  %8d KB" % (name, n, result['seconds'], result['peak_rss_kb']))
+            results.append(result)
+    
+    run = OrderedDict([
+        ('commit', commit()),
+        ('python', platform.python_version()),
+        ('date', time.strftime('%Y-%m-%d %H:%M:%S')),
+        ('results', results),
+    ])
+    with open(args.output, 'w') as f:
+        json.dump(run, f, indent=2)
+    print("Results written to %s" % args.output)
+    
+    if args.compare is not None:
+        with open(args.compare) as f:
+            old = json.load(f)
+        regressions = compare_results(old, run, args.tolerance)
+        print()
+        print("Compared with %s (commit %s)" % (args.compare, old.get('commit')))
+        for name, n, measure, a, b in regressions:
+            print("  regression: %s n=%d %s %g -> %g" % (name, n, measure, a, b))
+        if len(regressions) > 0:
+            sys.exit(1)
+        print("  no regressions")
@@ -0,0 +1,317 @@
+"""
+Persistent on-disk cache of trees and normal forms.
+
+For every number of leaves n and every kind of data ("trees", "normal_trees",
+"normal_pairs", "normal_triples", and "binary_normal_pairs", "binary_normal_triples"
+for the profiles of binary trees) there is one binary file in CACHE_DIR (the directory
+"cache" next to this file, or the one given by the environment variable CONSENSUS_CACHE_DIR).
+Trees on X = [1, ..., n] are identified by their index in the sorted list of
+all trees, so that tuples of trees are stored as flat arrays of integer IDs.
+The list of trees itself is stored as the cluster bitmasks of every tree.
+
+Every file starts with a header containing a version stamp: files written by
+a different version of the cache (or for different parameters) are ignored
+and recomputed. Solutions of models have their own version (see KIND_VERSIONS),
+which changes when the model changes, since a stale solution (or a stale proof of
+infeasibility) would be wrong rather than slow to recompute.
+"""
+
+import os
+import sys
+import struct
+import tempfile
+from array import array
+
+from tree import *
+
+
+CACHE_VERSION = 1
+CACHE_DIR = os.environ.get('CONSENSUS_CACHE_DIR') or os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cache')
+
+MAGIC = b'PHYC'
+HEADER = struct.Struct('<4sIIIc')   # magic, version, n, kind, array typecode
+
+KINDS = {
+    'trees': 0,
+    'normal_trees': 1,
+    'normal_pairs': 2,
+    'normal_triples': 3,
+    'refinement': 4,
+    'extension_solution': 5,
+    'restrictions': 6,
+    'binary_normal_pairs': 7,
+    'binary_normal_triples': 8,
+}
+
+# versions of the kinds of data which do not follow CACHE_VERSION
+KIND_VERSIONS = {
+    # 2: the rule symmetric_profile removed triples from the model of extension.py
+    'extension_solution': 2,
+}
+
+NORMAL_FORM_KINDS = [('normal_trees', 1), ('normal_pairs', 2), ('normal_triples', 3)]
+BINARY_NORMAL_FORM_KINDS = [('normal_trees', 1), ('binary_normal_pairs', 2), ('binary_normal_triples', 3)]
+
+
+def cache_path(n, kind):
+    """
+    Path of the cache file for the given number of leaves and kind of data.
+    """
+    return os.path.join(CACHE_DIR, 'n%d_%s.bin' % (n, kind))
+
+
+def kind_version(kind):
+    """
+    Version stamp of the cache files of the given kind of data.
+    """
+    return KIND_VERSIONS.get(kind, CACHE_VERSION)
+
+
+def write_array(n, kind, data):
+    """
+    Write an array of integers to the cache file, atomically.
+    """
+    if not os.path.isdir(CACHE_DIR):
+        os.makedirs(CACHE_DIR)
+    
+    if sys.byteorder == 'big':
+        data = array(data.typecode, data)
+        data.byteswap()
+    
+    fd, tmp_path = tempfile.mkstemp(dir=CACHE_DIR)
+    with os.fdopen(fd, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, kind_version(kind), n, KINDS[kind], data.typecode.encode('ascii')))
+        data.tofile(f)
+    os.chmod(tmp_path, 0o644)
+    os.rename(tmp_path, cache_path(n, kind))
+
+
+def read_array(n, kind):
+    """
+    Read an array of integers from the cache file.
+    Return None if the file does not exist or is stale.
+    """
+    path = cache_path(n, kind)
+    if not os.path.exists(path):
+        return None
+    
+    with open(path, 'rb') as f:
+        header = f.read(HEADER.size)
+        if len(header) < HEADER.size:
+            return None
+        
+        magic, version, n2, kind2, typecode = HEADER.unpack(header)
+        if magic != MAGIC or version != kind_version(kind) or n2 != n or kind2 != KINDS[kind]:
+            # stale or foreign cache file
+            return None
+        
+        data = array(typecode.decode('ascii'))
+        size = os.path.getsize(path) - HEADER.size
+        data.fromfile(f, size // data.itemsize)
+    
+    if sys.byteorder == 'big':
+        data.byteswap()
+    return data
+
+
+def id_typecode(num_trees):
+    "Smallest array typecode that can hold the IDs of num_trees trees."
+    return 'H' if num_trees <= 0xFFFF else 'I'
+
+
+def save_trees(n, trees):
+    """
+    Save the sorted list of all trees on [1, ..., n], as sequences of cluster bitmasks.
+    """
+    data = array('I')
+    for t in trees:
+        masks = sorted(cluster_masks(t))
+        data.append(len(masks))
+        data.extend(masks)
+    write_array(n, 'trees', data)
+
+
+def load_trees(n):
+    """
+    Load the sorted list of all trees on [1, ..., n].
+    Return None if they are not in the cache.
+    """
+    data = read_array(n, 'trees')
+    if data is None:
+        return None
+    
+    trees = []
+    i = 0
+    while i < len(data):
+        k = data[i]
+        trees.append(masks_to_tree(data[i+1:i+1+k]))
+        i += k+1
+    return trees
+
+
+def cached_trees(n, refresh=False):
+    """
+    Find the sorted list of all trees on [1, ..., n], loading it from the cache when possible.
+    """
+    trees = load_trees(n) if not refresh else None
+    if trees is None:
+        trees = list(all_trees(range(1, n+1)))
+        save_trees(n, trees)
+    
+    return trees
+
+
+def save_tuples(n, kind, arity, tuples, ids):
+    """
+    Save a list of trees (arity 1) or tuples of trees, encoded by their tree IDs.
+    """
+    data = array(id_typecode(len(ids)))
+    for tup in tuples:
+        if arity == 1:
+            data.append(ids[tup])
+        else:
+            data.extend(ids[t] for t in tup)
+    write_array(n, kind, data)
+
+
+def load_tuples(n, kind, arity, trees):
+    """
+    Load a list of trees (arity 1) or tuples of trees, decoding the tree IDs.
+    Return None if they are not in the cache.
+    """
+    data = read_array(n, kind)
+    if data is None:
+        return None
+    return decode_tuples(data, arity, trees)
+
+
+def decode_tuples(data, arity, trees):
+    """
+    Decode a flat array of tree IDs into a list of trees (arity 1) or tuples of trees.
+    """
+    if arity == 1:
+        return [trees[i] for i in data]
+    return [tuple(trees[i] for i in data[j:j+arity]) for j in range(0, len(data), arity)]
+
+
+def cached_normal_forms(n, processes=1, refresh=False, binary=False):
+    """
+    Find all trees on leaf set [1, ..., n], and the normal forms of trees, pairs and triples
+    (as sorted lists), loading them from the cache when possible.
+    If binary is True, only the normal forms of pairs of binary trees and of triples (t,r,s)
+    where r and s are binary are found (see find_encoded_normal_forms).
+    Anything that is computed is written to the cache. If refresh is True, the cache is not read.
+    """
+    X = list(range(1, n+1))
+    trees = cached_trees(n, refresh=refresh)
+    kinds = BINARY_NORMAL_FORM_KINDS if binary else NORMAL_FORM_KINDS
+    
+    normal_forms = None
+    if not refresh:
+        normal_forms = [load_tuples(n, kind, arity, trees) for kind, arity in kinds]
+        if any(res is None for res in normal_forms):
+            normal_forms = None
+    
+    if normal_forms is None:
+        # the IDs of find_encoded_normal_forms are the positions in the sorted list of trees
+        encoded = find_encoded_normal_forms(X, processes=processes, typecode=id_typecode(len(trees)), binary=binary)
+        normal_forms = []
+        for (kind, arity), data in zip(kinds, encoded):
+            write_array(n, kind, data)
+            normal_forms.append(decode_tuples(data, arity, trees))
+    
+    return [trees] + list(normal_forms)
+
+
+def cached_restriction_index(n, build, refresh=False):
+    """
+    Find the restriction index of the trees on subsets of [1, ..., n] (see TreeIndex.build_restriction_index),
+    loading it from the cache when possible, or computing it with build() and saving it.
+    """
+    data = read_array(n, 'restrictions') if not refresh else None
+    if data is None:
+        data = build()
+        write_array(n, 'restrictions', data)
+    
+    return data
+
+
+def trees_up_to(n):
+    """
+    List of all trees on [1, ..., i] for i = 1, ..., n (sorted for every i).
+    """
+    return [t for i in range(1, n+1) for t in cached_trees(i)]
+
+
+def save_solution(n, kind, solution):
+    """
+    Save a solution of a model whose variables are triples of trees on [1, ..., i] for i <= n
+    (as the set of triples with value 1), or None if the model is infeasible.
+    """
+    trees = trees_up_to(n)
+    save_tuples(n, kind, 3, sorted(solution or [], key=tree_key), {t: i for i, t in enumerate(trees)})
+
+
+def load_solution(n, kind):
+    """
+    Load a solution saved by save_solution. Return False if it is not in the cache,
+    and None if the model is infeasible.
+    Since a solution is never empty, an empty file means that the model is infeasible.
+    """
+    triples = load_tuples(n, kind, 3, trees_up_to(n))
+    if triples is None:
+        return False
+    return set(triples) or None
+
+
+def save_refinement_matrix(n, rows):
+    """
+    Save a packed boolean matrix (see refinement_matrix), as its size followed by
+    the 32-bit words of every row, least significant first.
+    """
+    words = (len(rows) + 31) // 32
+    data = array('I', [len(rows)])
+    for row in rows:
+        row_bytes = array('I')
+        row_bytes.frombytes(row.to_bytes(4*words, 'little'))
+        if sys.byteorder == 'big':
+            row_bytes.byteswap()
+        data.extend(row_bytes)
+    write_array(n, 'refinement', data)
+
+
+def load_refinement_matrix(n):
+    """
+    Load a packed boolean matrix (see refinement_matrix).
+    Return None if it is not in the cache.
+    """
+    data = read_array(n, 'refinement')
+    if data is None:
+        return None
+    
+    size = data[0]
+    words = (size + 31) // 32
+    if sys.byteorder == 'big':
+        data.byteswap()
+    row_bytes = data[1:].tobytes()
+    
+    rows = []
+    for i in range(size):
+        chunk = row_bytes[4*words*i : 4*words*(i+1)]
+        rows.append(int.from_bytes(chunk, 'little'))
+    return rows
+
+
+def cached_refinement_matrix(n, refresh=False):
+    """
+    Find the refinement matrix of the sorted list of all trees on [1, ..., n] (see refinement_matrix),
+    loading it from the cache when possible.
+    Since relabelling leaves with an increasing map preserves the order of trees, the same matrix
+    applies to the sorted list of trees on any leaf set of size n.
+    """
+    rows = load_refinement_matrix(n) if not refresh else None
+    if rows is None:
+        rows = refinement_matrix(cached_trees(n, refresh=refresh))
+        save_refinement_matrix(n, rows)
+    
+    return rows
@@ -0,0 +1,77 @@
+"""
+Certificates: the consensus methods found by the programs, in a compact format that can
+be checked independently of the models and of the solvers (see verify.py).
+
+A certificate is a JSON file with:
+- "program": the program that found it ("associative" or "extension");
+- "n": the number of leaves;
+- "feasible": false if there is no valid consensus method (nothing else is certified);
+- "triples": the normal triples (t,r,s), meaning that t is the consensus of r and s,
+  grouped by number of leaves k, where every tree on [1, ..., k] is encoded by its ID
+  (see tree_ids), e.g. {"3": [[0, 1, 1], ...], "4": [...]}.
+A consensus method is regular, so it is determined by its values on normal pairs: every
+triple stands for its orbit under the relabellings of its leaves into X = [1, ..., n]
+(with the second and the third tree exchanged).
+"""
+
+import json
+import itertools
+
+from tree import *
+
+
+def write_certificate(path, program, n, triples):
+    """
+    Write a certificate with the given triples of trees, or None if there is no valid consensus method.
+    """
+    certificate = {'program': program, 'n': n, 'feasible': triples is not None}
+    if triples is not None:
+        groups = {}
+        for triple in triples:
+            groups.setdefault(len(leaf_set(triple[0])), []).append(triple)
+        
+        certificate['triples'] = {}
+        for k, group in sorted(groups.items()):
+            ids = tree_ids(range(1, k+1))
+            certificate['triples'][str(k)] = sorted([ids[t] for t in triple] for triple in group)
+    
+    with open(path, 'w') as f:
+        json.dump(certificate, f, sort_keys=True)
+
+
+def read_certificate(path):
+    """
+    Read a certificate. Return the name of the program, the number of leaves, and the list of
+    triples of trees (None if there is no valid consensus method).
+    """
+    with open(path) as f:
+        certificate = json.load(f)
+    
+    if not certificate['feasible']:
+        return certificate['program'], certificate['n'], None
+    
+    triples = []
+    for k, group in sorted(certificate['triples'].items()):
+        trees = list(all_trees(range(1, int(k)+1)))
+        triples += [tuple(trees[i] for i in triple) for triple in group]
+    return certificate['program'], certificate['n'], triples
+
+
+def expand(triples, X):
+    """
+    Expand the triples of a regular consensus method to all the pairs of trees on subsets of X.
+    Return a dictionary from pairs (r,s) to their consensus, and the list of conflicts, i.e.
+    triples (t,r,s) such that (r,s) has already a different consensus.
+    """
+    consensus = {}
+    conflicts = []
+    for (t, r, s) in triples:
+        k = len(leaf_set(t))
+        for Y in itertools.combinations(X, k):
+            for image in itertools.permutations(Y):
+                sigma = dict(zip(range(1, k+1), image))
+                t2, r2, s2 = [apply_permutation(u, sigma) for u in (t, r, s)]
+                for pair in [(r2, s2), (s2, r2)]:
+                    if consensus.setdefault(pair, t2) != t2:
+                        conflicts.append((t2,) + pair)
+    return consensus, conflicts
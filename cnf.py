@@ -0,0 +1,153 @@
+"""
+Encoding of feasibility models with binary variables into CNF (DIMACS format).
+
+All constraints of our models have small integer coefficients, so every constraint
+is a cardinality constraint on literals: after replacing x by 1 - (not x) for the
+terms with negative coefficient, and repeating the literal of a term with
+coefficient c |c| times, it becomes "at most k" (or "at least k", or both) of a
+set of literals are true. Constraints such as implications and at-most-one on two
+variables are single clauses; larger at-most-k constraints are encoded with the
+sequential counter of Sinz (2005), which needs k auxiliary variables per literal,
+and exactly-one constraints are at-least-one clauses plus an at-most-one.
+
+The variables of the model are numbered 1, 2, ... in order, and auxiliary
+variables follow.
+"""
+
+import os
+import shutil
+import tempfile
+
+
+# at-most-one constraints on at most this many literals are encoded pairwise
+PAIRWISE_LIMIT = 5
+
+
+def at_most(literals, k, new_variable):
+    """
+    Clauses which force that at most k of the literals are true.
+    new_variable() must return a fresh variable.
+    """
+    n = len(literals)
+    if k >= n:
+        return []
+    if k < 0:
+        return [[]]
+    if k == 0:
+        return [[-x] for x in literals]
+    if k == n-1:
+        return [[-x for x in literals]]
+    if k == 1 and n <= PAIRWISE_LIMIT:
+        return [[-literals[i], -literals[j]] for i in range(n) for j in range(i+1, n)]
+    
+    # sequential counter: s[i][j] means that at least j+1 of the first i+1 literals are true
+    s = [[new_variable() for j in range(k)] for i in range(n-1)]
+    clauses = [[-literals[0], s[0][0]]]
+    clauses += [[-s[0][j]] for j in range(1, k)]
+    for i in range(1, n-1):
+        x = literals[i]
+        clauses.append([-x, s[i][0]])
+        clauses.append([-s[i-1][0], s[i][0]])
+        for j in range(1, k):
+            clauses.append([-x, -s[i-1][j-1], s[i][j]])
+            clauses.append([-s[i-1][j], s[i][j]])
+        clauses.append([-x, -s[i-1][k-1]])
+    clauses.append([-literals[n-1], -s[n-2][k-1]])
+    return clauses
+
+
+def at_least(literals, k, new_variable):
+    """
+    Clauses which force that at least k of the literals are true.
+    """
+    if k == 1:
+        return [list(literals)]
+    return at_most([-x for x in literals], len(literals) - k, new_variable)
+
+
+def encode(terms, sense, rhs, new_variable):
+    """
+    Clauses equivalent to the linear constraint (terms, sense, rhs), where terms are
+    pairs (coefficient, variable number) with distinct variables.
+    """
+    literals = []
+    repeated = False
+    for coef, x in terms:
+        if coef > 0:
+            literals += [x] * coef
+        elif coef < 0:
+            # -x = (not x) - 1
+            literals += [-x] * -coef
+            rhs -= coef
+        repeated |= abs(coef) > 1
+    
+    clauses = []
+    if sense in ('<=', '=='):
+        clauses += at_most(literals, rhs, new_variable)
+    if sense in ('>=', '=='):
+        clauses += at_least(literals, rhs, new_variable)
+    
+    if repeated:
+        # remove repeated literals from clauses
+        clauses = [sorted(set(clause), key=clause.index) for clause in clauses]
+    return clauses
+
+
+class DIMACSWriter(object):
+    """
+    Write streamed constraints to a file in DIMACS CNF format.
+    Clauses are written to a temporary file as they arrive, and are copied after
+    the header (which needs the number of variables and clauses) when closing.
+    """
+    
+    def __init__(self, path, variables):
+        self.path = path
+        self.ids = {var: i+1 for i, var in enumerate(variables)}
+        self.num_variables = len(variables)
+        self.num_clauses = 0
+        
+        fd, self.body_path = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(path)))
+        self.body = os.fdopen(fd, 'w')
+    
+    
+    def new_variable(self):
+        self.num_variables += 1
+        return self.num_variables
+    
+    
+    def add_constraints(self, name, offset, batch):
+        lines = []
+        for terms, sense, rhs in batch:
+            for clause in encode([(coef, self.ids[var]) for coef, var in terms], sense, rhs, self.new_variable):
+                lines.append(' '.join(str(x) for x in clause) + ' 0\n')
+        self.num_clauses += len(lines)
+        self.body.writelines(lines)
+    
+    
+    def close(self):
+        self.body.close()
+        with open(self.path, 'w') as f:
+            f.write("p cnf %d %d\n" % (self.num_variables, self.num_clauses))
+            with open(self.body_path) as body:
+                shutil.copyfileobj(body, f)
+        os.remove(self.body_path)
+
+
+def read_assignment(lines):
+    """
+    Read the output of a SAT solver in the format of the SAT competitions.
+    Return the set of true variables, or None if the formula is unsatisfiable.
+    """
+    status = None
+    true_variables = set()
+    for line in lines:
+        if line.startswith('s '):
+            status = line[2:].strip()
+        elif line.startswith('v '):
+            true_variables.update(x for x in (int(x) for x in line[2:].split()) if x > 0)
+    
+    if status == 'UNSATISFIABLE':
+        return None
+    if status != 'SATISFIABLE':
+        raise ValueError("unknown result of the SAT solver: %r" % status)
+    return true_variables
@@ -0,0 +1,145 @@
+"""
+Streaming emission of linear constraints over binary variables.
+
+A constraint is a triple (terms, sense, rhs), where terms is a list of pairs
+(coefficient, variable), sense is one of '<=', '>=', '==', and rhs is a number.
+Variables are identified by hashable keys (for example, triples of tree IDs).
+
+Constraints are produced by generators and passed to a sink in batches of
+fixed size, so that a family of constraints is never materialized as a whole.
+A sink can be a Gurobi model (GurobiSink) or an LP file (LPWriter).
+"""
+
+import sys
+import time
+
+import instrumentation
+
+
+BATCH_SIZE = 100000
+
+
+def emit(sink, name, constraints, batch_size=BATCH_SIZE, verbose=True):
+    """
+    Pass the constraints of a family to the sink, in batches of batch_size.
+    Report progress and speed after each batch. Return the number of constraints.
+    """
+    start = time.time()
+    count = 0
+    batch = []
+    
+    for constraint in constraints:
+        batch.append(constraint)
+        if len(batch) == batch_size:
+            sink.add_constraints(name, count, batch)
+            count += len(batch)
+            batch = []
+            
+            if verbose:
+                elapsed = time.time() - start
+                sys.stdout.write("  %s: %d constraints (%d per second)%s\n" % (name, count, count / max(elapsed, 1e-6), instrumentation.status()))
+                sys.stdout.flush()
+    
+    if len(batch) > 0:
+        sink.add_constraints(name, count, batch)
+        count += len(batch)
+    
+    if verbose:
+        elapsed = time.time() - start
+        print("  %s: %d constraints in %.1f seconds (%d per second)" % (name, count, elapsed, count / max(elapsed, 1e-6)))
+    
+    instrumentation.span(name, start, constraints=count)
+    instrumentation.count(**{name: count})
+    return count
+
+
+def merge_terms(terms):
+    """
+    Merge the terms with the same variable, and drop the ones with zero coefficient.
+    """
+    coefficients = {}
+    order = []
+    for coef, var in terms:
+        if var not in coefficients:
+            coefficients[var] = 0
+            order.append(var)
+        coefficients[var] += coef
+    
+    return [(coefficients[var], var) for var in order if coefficients[var] != 0]
+
+
+class GurobiSink(object):
+    """
+    Add streamed constraints to a Gurobi model.
+    The constraints of a family are named name[0], name[1], ...
+    """
+    
+    def __init__(self, model, variables):
+        # variables maps keys to Gurobi variables
+        self.model = model
+        self.variables = variables
+    
+    
+    def constraint(self, terms, sense, rhs):
+        """
+        Gurobi constraint (terms, sense, rhs), to be passed to addConstr or cbLazy.
+        """
+        from gurobipy import LinExpr
+        
+        expr = LinExpr([coef for coef, var in terms], [self.variables[var] for coef, var in terms])
+        if sense == '<=':
+            return expr <= rhs
+        elif sense == '>=':
+            return expr >= rhs
+        else:
+            return expr == rhs
+    
+    
+    def add_constraints(self, name, offset, batch):
+        self.model.addConstrs((self.constraint(*batch[i - offset]) for i in range(offset, offset + len(batch))), name)
+    
+    
+    def close(self):
+        self.model.update()
+
+
+class LPWriter(object):
+    """
+    Write streamed constraints to a file in (CPLEX) LP format, as a feasibility problem.
+    Variables are binary, and are named by a prefix followed by their keys, e.g. m_1_5_7.
+    """
+    
+    SENSES = {'<=': '<=', '>=': '>=', '==': '='}
+    
+    def __init__(self, path, variables, prefix='x', name='model'):
+        self.variables = variables
+        self.names = {var: var_name(prefix, var) for var in variables}
+        self.file = open(path, 'w')
+        self.file.write("\\ Problem: %s\n" % name)
+        self.file.write("Minimize\n obj: 0 %s\n" % (self.names[variables[0]] if len(variables) > 0 else ''))
+        self.file.write("Subject To\n")
+    
+    
+    def add_constraints(self, name, offset, batch):
+        lines = []
+        for i, (terms, sense, rhs) in enumerate(batch):
+            expr = ' '.join('%s %d %s' % ('-' if coef < 0 else '+', abs(coef), self.names[var]) for coef, var in merge_terms(terms))
+            lines.append(" %s_%d: %s %s %d\n" % (name, offset + i, expr or '0 %s' % self.names[self.variables[0]], self.SENSES[sense], rhs))
+        self.file.writelines(lines)
+    
+    
+    def close(self):
+        self.file.write("Binaries\n")
+        for var in self.variables:
+            self.file.write(" %s\n" % self.names[var])
+        self.file.write("End\n")
+        self.file.close()
+
+
+def var_name(prefix, var):
+    """
+    Name of a variable in an LP file, given its key.
+    """
+    if isinstance(var, tuple):
+        return '%s_%s' % (prefix, '_'.join(str(x) for x in var))
+    return '%s_%s' % (prefix, var)
@@ -0,0 +1,180 @@
+"""
+Irreducible infeasible subsystems (IIS) of infeasible models.
+
+An infeasible model is explained by a subset of its constraints which is infeasible, but
+becomes feasible if any of its constraints is removed: its core. The core is found by
+deletion, starting from all the constraints (or from the ones used by propagation to
+reach a contradiction, see presolve.py):
+- the constraints not known to be necessary are split into chunks, and every chunk is
+  removed if the remaining constraints are still infeasible;
+- the size of the chunks is halved at every pass, down to single constraints, which are
+  necessary if they cannot be removed.
+Since removing constraints only makes a model "more feasible", a chunk that could not be
+removed from a core cannot be removed from a smaller one either, unless it is a single
+constraint. Several chunks are tested at a time by a process pool (forked once, with the
+model, see fork_pool in parallel.py; every task is a chunk with the current core): the first
+removable one (in order) is removed, and the chunks after it are tested again against the
+smaller core.
+Every test presolves the candidate subsystem first: if propagation finds a contradiction,
+the constraints it used replace the candidate, otherwise the reduced model is solved.
+
+The core is written with its triples decoded, and it is small enough to be checked again
+(for example with the enumeration solver) in a few milliseconds.
+"""
+
+import time
+from collections import Counter
+
+import parallel
+from model import Model
+from presolve import propagate, reduce_model
+
+
+def subsystem(model, rows):
+    """
+    The model with the constraints with the given indices only, and with their variables.
+    The constraints of the subsystem are in the order of their indices, and keep their families.
+    """
+    rows = sorted(rows)
+    variables = sorted(set(model.columns[k] for i in rows for k in range(model.starts[i], model.starts[i+1])))
+    sub = Model(model.name, [model.variables[j] for j in variables], prefix=model.prefix)
+    for name, start, end in model.families:
+        batch = [next(model.constraints(i, i+1)) for i in rows if start <= i < end]
+        if len(batch) > 0:
+            sub.add_constraints(name, 0, batch)
+    return sub
+
+
+def explain(model, reasons):
+    """
+    Indices of the constraints used by propagation to reach a contradiction, given the reasons
+    collected by propagate: the infeasible constraint, the ones which fixed its variables, and so on.
+    """
+    used = set()
+    stack = [reasons[None]]
+    while len(stack) > 0:
+        i = stack.pop()
+        if i in used:
+            continue
+        used.add(i)
+        terms, sense, rhs = model.row(i)
+        stack.extend(reasons[j] for coef, j in terms if j in reasons)
+    return sorted(used)
+
+
+def infeasible_subset(model, rows, solver, threads=1):
+    """
+    Decide whether the constraints with the given indices are infeasible.
+    Return None if they are feasible, or else an infeasible subset of them: the constraints
+    used by propagation, if it finds a contradiction, or else all of them.
+    """
+    rows = sorted(rows)
+    sub = subsystem(model, rows)
+    reasons = {}
+    values = propagate(sub, [], reasons)
+    if values is None:
+        return [rows[i] for i in explain(sub, reasons)]
+    
+    reduced = reduce_model(sub, values)
+    if len(reduced) == 0 or len(solver.solve(reduced, threads=threads)) > 0:
+        return None
+    return rows
+
+
+def try_removal(model, solver, core, chunk):
+    """
+    Remove the constraints of the chunk from the core: return an infeasible subset of the
+    remaining constraints (see infeasible_subset), or None if they are feasible.
+    """
+    chunk = set(chunk)
+    return infeasible_subset(model, [i for i in core if i not in chunk], solver)
+
+
+def _try_removal_worker(args):
+    # the model and the solver are the state of the pool
+    core, chunk = args
+    model, solver = parallel.STATE
+    return try_removal(model, solver, core, chunk)
+
+
+def minimize(model, rows, solver, threads=1):
+    """
+    Find an irreducible infeasible subset of the constraints with the given indices,
+    testing up to threads removals at a time.
+    Return the sorted list of the indices of its constraints.
+    Raise ValueError if the constraints are feasible.
+    """
+    core = infeasible_subset(model, rows, solver, threads=threads)
+    if core is None:
+        raise ValueError("The constraints are feasible")
+    
+    pool = parallel.fork_pool(threads, (model, solver)) if threads > 1 else None
+    try:
+        necessary = set()
+        size = max(len(core) // 2, 1)
+        while True:
+            candidates = [i for i in core if i not in necessary]
+            pending = [candidates[k:k+size] for k in range(0, len(candidates), size)]
+            while len(pending) > 0:
+                batch = pending[:threads]
+                pending = pending[len(batch):]
+                
+                if pool is not None and len(batch) > 1:
+                    results = pool.map(_try_removal_worker, [(core, chunk) for chunk in batch])
+                else:
+                    results = [try_removal(model, solver, core, chunk) for chunk in batch]
+                
+                for k, (chunk, res) in enumerate(zip(batch, results)):
+                    if res is not None:
+                        # the chunk is removed (with the constraints not used by propagation)
+                        core = res
+                        pending = batch[k+1:] + pending
+                        break
+                    elif size == 1:
+                        necessary.update(chunk)
+                
+                remaining = set(core)
+                pending = [c for c in ([i for i in chunk if i in remaining] for chunk in pending) if len(c) > 0]
+            
+            if size == 1:
+                return core
+            size //= 2
+    finally:
+        if pool is not None:
+            pool.terminate()
+
+
+def families(model, core):
+    """
+    Number of constraints of the core, by family.
+    """
+    return Counter(model.constraint_name(i).split('[')[0] for i in core)
+
+
+def write_core(path, model, core, decode):
+    """
+    Write the constraints of the core to a file, with their names in the whole model,
+    followed by the triples they contain, decoding variables with the given function.
+    """
+    variables = sorted(set(model.columns[k] for i in core for k in range(model.starts[i], model.starts[i+1])))
+    with open(path, 'w') as f:
+        f.write("# %d constraints, %d triples\n" % (len(core), len(variables)))
+        for i in core:
+            terms, sense, rhs = model.row(i)
+            f.write("%s: %s %s %d\n" % (model.constraint_name(i), ' '.join("%+d %r" % (coef, decode(model.variables[j])) for coef, j in terms), sense, rhs))
+        f.write("\n")
+        for j in variables:
+            f.write("%r\n" % (decode(model.variables[j]),))
+
+
+def find_core(model, rows, solver, path, decode, threads=1):
+    """
+    Find an irreducible infeasible subset of the constraints with the given indices (see minimize),
+    write it to a file (see write_core), and report its size.
+    """
+    print("Find an irreducible infeasible subset of the constraints")
+    start = time.time()
+    core = minimize(model, rows, solver, threads=threads)
+    write_core(path, model, core, decode)
+    print("  %d constraints (%s) found in %.1f seconds, written to %s" % (len(core), ', '.join("%d %s" % (count, name) for name, count in sorted(families(model, core).items())), time.time() - start, path))
+    return core
@@ -1,119 +1,347 @@
 import sys
 import itertools
 import argparse
-from gurobipy import *
+from array import array
 
 from tree import *
+from cache import cached_normal_forms, cached_refinement_matrix, save_solution, load_solution
+from certificate import write_certificate
+from core import find_core
+from index import TreeIndex
+from constraints import emit
+from model import Model
+from solvers import SOLVERS, get_solver
+from parallel import map_shards, variable_rows
+from presolve import unanimity, symmetric_profile, violated_rules_shard, filter_triples, presolve, write_log, summary
+import instrumentation
+import memo
+
+
+def extension_stability_cliques(index, triples, possible_triples, refinement_matrices):
+    """
+    Generate the triples (t,r,s) with the sets of triples (u,r|Z,s|Z) which are not compatible with
+    (t,r,s) by extension stability, because u <= t|Z does not hold (one nonempty set for every
+    subset Z). The first triple ranges over triples, and the second ones over the set possible_triples.
+    The second triples are consensus triples of the same pair of trees (r|Z, s|Z) up to symmetry, so
+    at most one of them has value 1, and together with (t,r,s) they form a clique of incompatible triples.
+    refinement_matrices[k] is the refinement matrix of the trees on k leaves.
+    """
+    for (t, r, s) in triples:
+        Y = mask_to_leaves(index.leaves[t])
+        for Z in powerset(Y):
+            if len(Z) >= 3 and len(Z) < len(Y):
+                restriction_Z = index.restriction_table(leaves_to_mask(Z))
+                trees_Z = index.trees_on(Z)
+                refined = refinement_matrices[len(Z)][restriction_Z[t] - trees_Z[0]]
+                
+                # trees u on Z such that u <= t|Z does not hold
+                conflicts = set()
+                for i in set_bits(~refined & ((1 << len(trees_Z)) - 1)):
+                    u = trees_Z[i]
+                    second_triple = index.normalize((u, restriction_Z[r], restriction_Z[s]))
+                    if second_triple in possible_triples:
+                        conflicts.add(second_triple)
+                
+                if len(conflicts) > 0:
+                    yield (t,r,s), conflicts
+
+
+def extension_stability_shard(state, start, end):
+    """
+    Encode the cliques given by extension_stability_cliques, for the possible triples in [start, end),
+    as rows of variables (indices in the list of possible triples) preceded by their length, see
+    variable_rows. With state['pairwise'], every clique is split into pairs of incompatible triples.
+    Cliques contained in one with the same first triple that was already found (for another subset
+    Z) are skipped, and so are duplicate pairs.
+    Run in worker processes (see parallel.py).
+    """
+    variables = state['variables']
+    res = array('i')
+    previous = None
+    for first_triple, conflicts in extension_stability_cliques(state['index'], state['possible_triples'][start:end], variables, state['refinement_matrices']):
+        if first_triple != previous:
+            # second triples already paired with the current first triple, and its cliques
+            seen = set()
+            cliques = []
+            previous = first_triple
+        first = variables[first_triple]
+        seconds = set(variables[triple] for triple in conflicts)
+        
+        if state['pairwise']:
+            for second in sorted(seconds - seen):
+                res.extend((2, first, second))
+        elif not (seconds <= seen and any(seconds <= clique for clique in cliques)):
+            res.append(len(seconds) + 1)
+            res.append(first)
+            res.extend(sorted(seconds))
+            cliques.append(seconds)
+        seen |= seconds
+    return res
+
+
+def add_constraints(model, index, triples, pairs, variables, refinement_matrices, processes=1, suffix='', pairwise=False):
+    """
+    Add the extension stability constraints where the first triple is in triples, and the
+    constraints that every pair in pairs has exactly one consensus tree.
+    variables maps every possible triple to its index in the list of possible triples.
+    The suffix is appended to the names of the families of constraints.
+    Extension stability constraints say that at most one triple of every clique given by
+    extension_stability_cliques has value 1, or, if pairwise is True, the same for every pair
+    of incompatible triples (more constraints, with the same integer solutions).
+    """
+    possible_triples = [None] * len(variables)
+    for triple, i in variables.items():
+        possible_triples[i] = triple
+    
+    # state shared with the worker processes
+    state = {
+        'index': index,
+        'possible_triples': triples,
+        'variables': variables,
+        'refinement_matrices': refinement_matrices,
+        'pairwise': pairwise,
+    }
+    
+    emit(model, "extstab" + suffix, (
+        ([(1, possible_triples[var]) for var in clique], '<=', 1) \
+        for clique in variable_rows(map_shards(extension_stability_shard, state, len(triples), processes=processes))
+    ))
+    
+    matching = {pair: set() for pair in pairs}
+    for (t,r,s) in triples:
+        for pair in [index.normalize((r,s)), index.normalize((s,r))]:
+            if pair in matching:
+                matching[pair].add((t,r,s))
+    
+    emit(model, "consensusexists" + suffix, (
+        ([(1, triple) for triple in sorted(matching[pair])], '==', 1) for pair in matching
+    ))
+
+
+def solve_incrementally(index, possible_triples, normal_pairs, solver, threads=1, refresh=False, pairwise=False):
+    """
+    Solve the models for 3, 4, ..., n leaves, where every model extends the previous one
+    with the variables and constraints of the trees on one more leaf.
+    The solution of each model is a starting point for the next one. Solutions are cached,
+    and a cached solution which satisfies the current model is reused without solving it.
+    If the model for k leaves is infeasible, so are the following ones.
+    Return the solutions of the last model that was solved.
+    """
+    n = index.n
+    variables = {triple: i for i, triple in enumerate(possible_triples)}
+    refinement_matrices = {}
+    model = Model('phylogenetictrees', [], prefix='m')
+    solution = set()
+    
+    for k in range(3, n+1):
+        print("Extend the model to %d leaves" % k)
+        instrumentation.phase("model for %d leaves" % k)
+        on_k_leaves = lambda t: popcount(index.leaves[t]) == k
+        triples = [triple for triple in possible_triples if on_k_leaves(triple[0])]
+        pairs = [(r,s) for (r,s) in normal_pairs if on_k_leaves(r)]
+        if k > 3:
+            refinement_matrices[k-1] = cached_refinement_matrix(k-1, refresh=refresh)
+        
+        model.add_variables(triples)
+        add_constraints(model, index, triples, pairs, variables, refinement_matrices, processes=threads, suffix='_%d' % k, pairwise=pairwise)
+        print("The model has %d variables and %d constraints" % (len(model.variables), len(model)))
+        
+        cached = load_solution(k, 'extension_solution') if not refresh else False
+        if cached is None:
+            print("The model for %d leaves is infeasible (cached)" % k)
+            return []
+        if cached is not False:
+            cached = set(index.encode(triple) for triple in cached)
+            if next(model.violated(cached), None) is None:
+                print("Reuse the cached solution for %d leaves" % k)
+                solution = cached
+                continue
+        
+        instrumentation.phase("solve for %d leaves" % k)
+        instrumentation.count(variables=len(model.variables), constraints=len(model))
+        start = {var: int(var in solution) for var in model.variables if not on_k_leaves(var[0])}
+        solutions = solver.solve(model, threads=threads, start=start)
+        if len(solutions) == 0:
+            save_solution(k, 'extension_solution', None)
+            print("The model for %d leaves is infeasible" % k)
+            return []
+        
+        solution = solutions[0]
+        save_solution(k, 'extension_solution', [index.decode(triple) for triple in solution])
+    
+    return [solution]
+
+
+def print_solution(X, index, possible_triples, solutions):
+    """
+    Print the consensus method given by the first solution, if there is one.
+    """
+    print()
+    if len(solutions) == 0:
+        print("There is no valid consensus method for X = %r" % X)
+
+    else:
+        print("Found consensus method for X = %r:" % X)
+        print()
+        for (t,r,s) in possible_triples:
+            if (t,r,s) in solutions[0]:
+                print("%r ^ %r = %r" % index.decode((r,s,t)))
 
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Find a regular consensus method that satisfies extension stability on profiles of two binary trees.')
     
-    parser.add_argument('n', nargs='?', default=3, type=int, choices=[3,4,5], help='number of leaves (between 3 and 5, default 3)')
-    parser.add_argument('-t', '--threads', default=1, type=int, help='number of threads that can be used')
+    parser.add_argument('n', nargs='?', default=3, type=int, choices=[3,4,5,6], help='number of leaves (between 3 and 6, default 3)')
+    parser.add_argument('-t', '--threads', default=1, type=int, help='number of threads (and processes) that can be used')
+    parser.add_argument('--recompute', action='store_true', help='recompute normal forms instead of loading them from the cache')
+    parser.add_argument('-s', '--solver', default='gurobi', choices=sorted(SOLVERS), help='solver to use (default gurobi)')
+    parser.add_argument('--presolve', action='store_true', help='fix the variables forced by propagation of the constraints, and remove them from the model')
+    parser.add_argument('--presolve-log', metavar='FILE', help='write the log of eliminated variables to a file')
+    parser.add_argument('--lp', metavar='FILE', help='write the model to an LP file instead of solving it')
+    parser.add_argument('--mps', metavar='FILE', help='write the model to an MPS file instead of solving it')
+    parser.add_argument('--cnf', metavar='FILE', help='write the model to a DIMACS CNF file instead of solving it')
+    parser.add_argument('--incremental', action='store_true', help='solve the models for 3, 4, ..., n leaves, each extending the previous one')
+    parser.add_argument('--pairwise', action='store_true', help='write extension stability constraints for pairs of triples instead of cliques')
+    parser.add_argument('--certificate', metavar='FILE', help='write the consensus method found (or the infeasibility of the model) to a certificate file, which can be checked with verify.py')
+    parser.add_argument('--core', metavar='FILE', help='if there is no valid consensus method, find an irreducible infeasible subset of the constraints (testing up to --threads removals at a time) and write it to a file')
+    parser.add_argument('--cache-limit', metavar='ENTRIES', type=int, help='maximum number of entries of each in-memory cache of normal forms and clusters (default no limit)')
+    parser.add_argument('--trace', metavar='FILE', help='write a trace of the phases of the run (time, memory, counters) to a file in Chrome trace format')
     args = parser.parse_args()
+    
+    if args.incremental and (args.presolve or args.lp or args.mps or args.cnf):
+        parser.error("--incremental cannot be used with --presolve, --lp, --mps, --cnf")
+    if args.incremental and args.core:
+        parser.error("--incremental cannot be used with --core")
 
 
+    if args.trace is not None:
+        instrumentation.start(args.trace)
+    memo.set_limit(args.cache_limit)
+    
     n = args.n
-    print "n =", n
-    X = range(1, n+1)
-    print "X =", X
+    print("n =", n)
+    X = list(range(1, n+1))
+    print("X =", X)
     
     trees = []
     normal_trees = []
     normal_pairs = []
     normal_triples = []
     
-    print "Compute normal forms of tuples of trees up to %d leaves" % n
-    for i in xrange(3, n+1):
-        Y = range(1, i+1)
-        
-        trees += list(all_trees(Y))
-        
-        normal_trees_Y, normal_pairs_Y, normal_triples_Y = find_normal_forms(Y, processes=args.threads)
+    print("Compute normal forms of tuples of trees up to %d leaves" % n)
+    instrumentation.phase("normal forms")
+    for i in range(3, n+1):
+        # only the profiles of binary trees (with any consensus tree)
+        trees_Y, normal_trees_Y, normal_pairs_Y, normal_triples_Y = cached_normal_forms(i, processes=args.threads, refresh=args.recompute, binary=True)
         
+        trees += trees_Y
         normal_trees += normal_trees_Y
         normal_pairs += normal_pairs_Y
         normal_triples += normal_triples_Y
     
-    print
+    print()
     
-    print "There are %d trees, %d normal trees, %d normal pairs, and %d normal triples" % (len(trees), len(normal_trees), len(normal_pairs), len(normal_triples))
+    print("There are %d trees, %d normal trees, %d normal pairs of binary trees, and %d normal triples of binary profiles" % (len(trees), len(normal_trees), len(normal_pairs), len(normal_triples)))
     
+    instrumentation.count(trees=len(trees), normal_trees=len(normal_trees), normal_pairs=len(normal_pairs), normal_triples=len(normal_triples))
     
-    print "Find possible consensus triples between binary trees"
-    possible_triples = []
-    for triple in normal_triples:
-        t, r, s = triple
-        Y = leaf_set(t)
-        
-        if r == s and t != r:
-            # (t,r,r) is possible only for t=r (unanimity)
-            continue
-        
-        if not is_binary(r) or not is_binary(s):
-            # we are only interested in pairs of binary trees
-            continue
-        
-        possible_triples.append(triple)
+    print("Index trees")
+    instrumentation.phase("index")
+    # from now on, trees are represented by their IDs
+    index = TreeIndex(n, cached=True, refresh=args.recompute)
+    trees = [index.ids[t] for t in trees]
+    normal_trees = [index.ids[t] for t in normal_trees]
+    normal_pairs = [index.encode(pair) for pair in normal_pairs]
+    normal_triples = [index.encode(triple) for triple in normal_triples]
     
     
-    print "There are %d possible triples" % len(possible_triples)
+    print("Find possible consensus triples between binary trees")
+    instrumentation.phase("possible triples")
+    log = []
+    rules = [unanimity, symmetric_profile]
+    state = {
+        'index': index,
+        'triples': normal_triples,
+        'rules': rules,
+    }
+    violated = itertools.chain.from_iterable(map_shards(violated_rules_shard, state, len(normal_triples), processes=args.threads, typecode='b'))
+    possible_triples = filter_triples(normal_triples, violated, rules, log)
     
-    ### create optimization model ###
-    model = Model('phylogenetictrees')
+    print("There are %d possible triples" % len(possible_triples))
+    instrumentation.count(possible_triples=len(possible_triples))
+    for reason, count in sorted(summary(log).items()):
+        print("  %d triples excluded by %s" % (count, reason))
     
-    print "Create variables"
-    # m[t,r,s] == 1 means that t is the consensus tree of r and s
+    if args.incremental:
+        solutions = solve_incrementally(index, possible_triples, normal_pairs, get_solver(args.solver), threads=args.threads, refresh=args.recompute, pairwise=args.pairwise)
+        print_solution(X, index, possible_triples, solutions)
+        if args.certificate is not None:
+            write_certificate(args.certificate, 'extension', n, [index.decode(triple) for triple in solutions[0]] if len(solutions) > 0 else None)
+        sys.exit(0)
     
-    m = model.addVars(possible_triples, name="m", vtype=GRB.BINARY)
+    ### create optimization model ###
+    print("Create variables")
+    instrumentation.phase("variables")
+    # m[t,r,s] == 1 means that t is the consensus tree of r and s
+    model = Model('phylogenetictrees', possible_triples, prefix='m')
     
-    print "Add extension stability constraints on binary trees"
-    extension_stability_constraints = []
-    for (t, r, s) in possible_triples:
-        Y = leaf_set(t)
-        for Z in powerset(Y):
-            if len(Z) >= 3 and len(Z) < len(Y):
-                for u in all_trees(Z):
-                    if not compare(u, restriction(t, Z)):
-                        second_triple = normalize_tuple((u, restriction(r, Z), restriction(s, Z)))
-                        if second_triple in m:
-                            extension_stability_constraints.append(((t,r,s), second_triple))
+    print("Add extension stability constraints on binary trees, and force that every (normal) pair has exactly one consensus tree")
+    instrumentation.phase("constraints")
+    # refinement_matrices[k][i] is the bitset of the trees refined by the i-th tree on k leaves
+    refinement_matrices = {k: cached_refinement_matrix(k, refresh=args.recompute) for k in range(3, n)}
+    add_constraints(model, index, possible_triples, normal_pairs, {triple: i for i, triple in enumerate(possible_triples)}, refinement_matrices, processes=args.threads, pairwise=args.pairwise)
     
-    model.addConstrs((m[first_triple] + m[second_triple] <= 1 for first_triple, second_triple in extension_stability_constraints), "extstab")
+    # the core is found among the constraints of the whole model
+    whole_model = model
+    fixed = {}
+    if args.presolve:
+        print("Presolve")
+        instrumentation.phase("presolve")
+        num_excluded = len(log)
+        model, fixed = presolve(model, log)
+        for reason, count in sorted(summary(log[num_excluded:]).items()):
+            print("  %d variables fixed by %s" % (count, reason))
     
-    print "Force that every (normal) pair has exactly one consensus tree"
-    matching = {(r,s): set() for (r,s) in normal_pairs if is_binary(r) and is_binary(s)}
-    for (t,r,s) in possible_triples:
-        matching[normalize_tuple((r,s))].add((t,r,s))
-        if r != s:
-            matching[normalize_tuple((s,r))].add((t,r,s))
+    if args.presolve_log is not None:
+        write_log(args.presolve_log, log, index.decode)
     
-    model.addConstrs((
-        sum(m[triple] for triple in matching[pair]) == 1 for pair in matching
-    ), "consensusexists")
+    if model is None:
+        print()
+        print("There is no valid consensus method for X = %r (found by presolve: %s)" % (X, log[-1][2]))
+        if args.certificate is not None:
+            write_certificate(args.certificate, 'extension', n, None)
+        if args.core is not None:
+            find_core(whole_model, range(len(whole_model)), get_solver(args.solver), args.core, index.decode, threads=args.threads)
+        sys.exit(0)
     
+    if args.presolve:
+        print("%d variables fixed, %d variables and %d constraints left" % (len(fixed), len(model.variables), len(model)))
     
-    ### solve ###
-    kwargs = {
-        "Threads": args.threads,
-    }
+    if args.lp is not None or args.mps is not None or args.cnf is not None:
+        instrumentation.phase("write model")
+        if args.lp is not None:
+            model.write_lp(args.lp)
+            print("Model written to %s" % args.lp)
+        if args.mps is not None:
+            model.write_mps(args.mps)
+            print("Model written to %s" % args.mps)
+        if args.cnf is not None:
+            model.write_cnf(args.cnf)
+            print("Model written to %s" % args.cnf)
+        sys.exit(0)
     
-    for (arg, val) in kwargs.iteritems():
-        model.setParam(arg, val)
-    
-    model.optimize()
-
-    print
-    if model.Status == GRB.INFEASIBLE:
-        print "There is no valid consensus method for X = %r" % X
-
-    else:
-        print "Found consensus method for X = %r:" % X
-        print
-        for (t,r,s), v in m.iteritems():
-            if v.x > 0.5:
-                print "%r ^ %r = %r" % (r,s,t)
     
+    ### solve ###
+    instrumentation.phase("solve")
+    instrumentation.count(variables=len(model.variables), constraints=len(model), caches=memo.statistics())
+    solutions = get_solver(args.solver).solve(model, threads=args.threads)
 
+    # add the variables fixed to 1 by presolve
+    ones = set(var for var, value in fixed.items() if value == 1)
+    solutions = [solution | ones for solution in solutions]
 
+    print_solution(X, index, possible_triples, solutions)
+    if args.certificate is not None:
+        write_certificate(args.certificate, 'extension', n, [index.decode(triple) for triple in solutions[0]] if len(solutions) > 0 else None)
+    if args.core is not None and len(solutions) == 0:
+        find_core(whole_model, range(len(whole_model)), get_solver(args.solver), args.core, index.decode, threads=args.threads)
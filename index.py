@@ -0,0 +1,193 @@
+"""
+Dense integer IDs for all phylogenetic trees on non-empty subsets of X = [1, ..., n].
+
+Trees are grouped by leaf set (in the order given by powerset), and sorted inside
+each group, and the ID of a tree is its position in this order.
+On top of the IDs, the following tables (indexed by ID) are available:
+leaf set and clusters (as bitmasks), binarity, normal form, and restriction to
+every subset Y of X. The restrictions of all trees to all subsets of X form the
+restriction index, which is built (or loaded from the cache) on first use.
+Tuples of trees are represented as tuples of IDs. The normal forms of all pairs of
+trees on X can be computed in advance, and shared with worker processes.
+"""
+
+import itertools
+from array import array
+
+from tree import *
+from memo import Memo, SharedTable
+from parallel import map_shards
+import cache
+
+
+def pair_table_shard(index, start, end):
+    """
+    Normal forms of the pairs of trees on X whose first tree is the start-th, ..., (end-1)-th tree on X,
+    each encoded as a single integer (see TreeIndex.share_pair_table).
+    Run in worker processes (see parallel.py).
+    """
+    trees_X = index.trees_on(index.X)
+    res = array('l')
+    for t in range(trees_X[0] + start, trees_X[0] + end):
+        for s in trees_X:
+            r, q = index.encode(normalize_tuple(index.decode((t,s))))
+            res.append(r * len(index) + q)
+    return res
+
+
+class TreeIndex(object):
+    """
+    Index of all the phylogenetic trees on non-empty subsets of [1, ..., n].
+    """
+    
+    def __init__(self, n, cached=False, refresh=False):
+        """
+        If cached is True, the restriction index is loaded from the cache (see cache.py) when
+        possible, and saved to it otherwise; if refresh is True, the cache is not read.
+        """
+        self.n = n
+        self.cached = cached
+        self.refresh = refresh
+        self.X = list(range(1, n+1))
+        
+        self.trees = []
+        self.ranges = {}    # leaf set (as a bitmask) -> range of IDs
+        for Y in powerset(self.X):
+            if len(Y) > 0:
+                start = len(self.trees)
+                self.trees.extend(all_trees(Y))
+                self.ranges[leaves_to_mask(Y)] = range(start, len(self.trees))
+        
+        self.ids = {t: i for i, t in enumerate(self.trees)}
+        
+        self.leaves = array('I', (leaf_mask(t) for t in self.trees))
+        self.clusters = [cluster_masks(t) for t in self.trees]
+        self.binary = array('b', (is_binary(t) for t in self.trees))
+        self.normal = array('i', (self.ids[normalize_tree(t)] for t in self.trees))
+        
+        self.restriction_index = None
+        self.restrictions = {}      # leaf set (as a bitmask) -> table of restrictions
+        self.normal_tuples = Memo('TreeIndex(%d).normal_tuples' % n)
+        self.pair_table = None
+    
+    
+    def __len__(self):
+        return len(self.trees)
+    
+    
+    def encode(self, tup):
+        """
+        Find the IDs of a tuple of trees.
+        """
+        return tuple(self.ids[t] for t in tup)
+    
+    
+    def decode(self, tup):
+        """
+        Find the trees of a tuple of IDs.
+        """
+        return tuple(self.trees[i] for i in tup)
+    
+    
+    def trees_on(self, Y):
+        """
+        IDs of all trees on the leaf set Y.
+        """
+        return self.ranges[leaves_to_mask(Y)]
+    
+    
+    def build_restriction_index(self):
+        """
+        Compute the restrictions of all trees to all subsets of X, as a flat array: the restriction
+        of the tree i to the leaf set with bitmask mask is at position i * 2**n + (mask >> 1)
+        (leaf x is the bit 1 << x), and it is -1 if the leaf sets are disjoint.
+        Trees are processed by increasing number of leaves, so that the restriction of a tree i
+        to a proper subset M of its leaf set L is the restriction to M of the tree obtained by
+        removing one leaf x of L - M from i, which is already in the table.
+        """
+        size = 1 << self.n
+        index = array('h' if len(self.trees) < 1 << 15 else 'i', [-1]) * (len(self.trees) * size)
+        
+        for i, t in enumerate(self.trees):
+            L = self.leaves[i]
+            # trees obtained by removing one leaf (none if t has a single leaf)
+            removed = {x: self.ids[mask_restriction(t, L & ~(1 << x))] for x in set_bits(L) if L & ~(1 << x)}
+            
+            for m in range(size):
+                M = (m << 1) & L
+                if M == L:
+                    index[i * size + m] = i
+                elif M != 0:
+                    # lowest leaf of L - M
+                    x = ((L & ~M) & -(L & ~M)).bit_length() - 1
+                    index[i * size + m] = index[removed[x] * size + m]
+        
+        return index
+    
+    
+    def load_restriction_index(self):
+        """
+        Build the restriction index, or load it from the cache, if it has not been done yet.
+        """
+        if self.restriction_index is None:
+            if self.cached:
+                self.restriction_index = cache.cached_restriction_index(self.n, self.build_restriction_index, refresh=self.refresh)
+            else:
+                self.restriction_index = self.build_restriction_index()
+        
+        return self.restriction_index
+    
+    
+    def restriction_table(self, mask):
+        """
+        Table of the restrictions of all trees to the leaf set given by a bitmask.
+        The entry is -1 if the leaf sets are disjoint.
+        """
+        if mask not in self.restrictions:
+            self.restrictions[mask] = self.load_restriction_index()[mask >> 1 :: 1 << self.n]
+        
+        return self.restrictions[mask]
+    
+    
+    def restriction(self, i, Y):
+        """
+        ID of the restriction of the tree i to the leaf set Y (-1 if they are disjoint).
+        """
+        return self.restriction_table(leaves_to_mask(Y))[i]
+    
+    
+    def compare(self, i, j):
+        """
+        Check if the tree i is <= the tree j.
+        """
+        return self.clusters[i] <= self.clusters[j]
+    
+    
+    def share_pair_table(self, processes=1):
+        """
+        Compute the normal forms of all pairs of trees on X, and store them in shared memory,
+        where they are used by normalize (also in the worker processes of parallel.py, which are
+        forked later, see fork_pool).
+        The pair (i, j) of the a-th and b-th tree on X is at position a * m + b, where m is
+        the number of trees on X, and its normal form (r, s) is encoded as r * len(self) + s.
+        """
+        trees_X = self.trees_on(self.X)
+        self.pair_table = SharedTable(itertools.chain.from_iterable(map_shards(pair_table_shard, self, len(trees_X), processes=processes, typecode='l')), typecode='l')
+        self.pair_start = trees_X[0]
+        self.pair_size = len(trees_X)
+    
+    
+    def normalize(self, tup):
+        """
+        Find the normal form of a tuple of IDs (see normalize_tuple).
+        """
+        if self.pair_table is not None and len(tup) == 2:
+            # the trees on X are the ones with the largest IDs
+            a, b = tup[0] - self.pair_start, tup[1] - self.pair_start
+            if a >= 0 and b >= 0:
+                return divmod(self.pair_table.data[a * self.pair_size + b], len(self.trees))
+        
+        if tup not in self.normal_tuples:
+            self.normal_tuples[tup] = self.encode(normalize_tuple(self.decode(tup)))
+        
+        return self.normal_tuples[tup]
@@ -0,0 +1,185 @@
+"""
+Instrumentation of long runs: timing of phases, memory usage and counters.
+
+It is disabled unless start() is called (option --trace of the programs), and
+then records:
+- phases of a run (e.g. "normal forms", "meet constraints"), which follow each
+  other, and spans inside them (e.g. the generation of a family of constraints);
+- the resident set size of the process, sampled periodically by a thread, and
+  the peak memory of the worker processes at the end of every phase;
+- counters attached to the current phase (e.g. the number of trees, or of
+  constraints of every family);
+- the progress of the current work (e.g. the shards of map_shards), from which
+  an estimate of the remaining time is computed.
+At exit, everything is written to a file in the Trace Event Format of Chrome,
+which can be loaded in chrome://tracing, Perfetto or speedscope.
+"""
+
+import os
+import sys
+import json
+import time
+import atexit
+import resource
+import threading
+
+
+# seconds between samples of the memory usage
+SAMPLE_INTERVAL = 0.5
+
+# the current tracer (None if instrumentation is disabled)
+TRACER = None
+
+
+def current_rss():
+    """
+    Resident set size of the process in KB (the peak one, where /proc is not available).
+    """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * (os.sysconf('SC_PAGE_SIZE') // 1024)
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+
+class Tracer(object):
+    """
+    Events of a run, in the Trace Event Format.
+    """
+    
+    def __init__(self, path):
+        self.path = path
+        self.start = time.time()
+        self.events = []
+        self.pid = os.getpid()
+        
+        self.phase = None       # name, start time, counters
+        self.progress = None    # start time and completed fraction of the current work
+        
+        self.sampler = threading.Thread(target=self.sample)
+        self.sampler.daemon = True
+        self.sampler.start()
+    
+    
+    def timestamp(self, t=None):
+        # microseconds since the start
+        return int(((t if t is not None else time.time()) - self.start) * 1e6)
+    
+    
+    def sample(self):
+        while True:
+            self.counter("memory", rss_mb=current_rss() / 1024.)
+            time.sleep(SAMPLE_INTERVAL)
+    
+    
+    def counter(self, name, **values):
+        self.events.append({'name': name, 'ph': 'C', 'ts': self.timestamp(), 'pid': self.pid, 'args': values})
+    
+    
+    def span(self, name, start, end, args):
+        self.events.append({'name': name, 'ph': 'X', 'ts': self.timestamp(start), 'dur': self.timestamp(end) - self.timestamp(start), 'pid': self.pid, 'tid': 0, 'args': args})
+    
+    
+    def begin_phase(self, name):
+        self.end_phase()
+        self.phase = (name, time.time(), {})
+        self.progress = None
+    
+    
+    def end_phase(self):
+        if self.phase is not None:
+            name, start, counters = self.phase
+            counters['rss_kb'] = current_rss()
+            counters['peak_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            counters['children_peak_rss_kb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+            self.span(name, start, time.time(), counters)
+            self.phase = None
+    
+    
+    def close(self):
+        self.end_phase()
+        self.counter("memory", rss_mb=current_rss() / 1024.)
+        with open(self.path, 'w') as f:
+            json.dump({'traceEvents': list(self.events), 'displayTimeUnit': 'ms', 'otherData': {'command': ' '.join(sys.argv)}}, f)
+
+
+def start(path):
+    """
+    Enable instrumentation, and write the trace to the given file at exit.
+    """
+    global TRACER
+    TRACER = Tracer(path)
+    atexit.register(stop)
+
+
+def stop():
+    """
+    Write the trace, and disable instrumentation.
+    """
+    global TRACER
+    if TRACER is not None:
+        TRACER.close()
+        TRACER = None
+
+
+def enabled():
+    """
+    Check if instrumentation is enabled.
+    """
+    return TRACER is not None
+
+
+def phase(name):
+    """
+    End the current phase, and begin a new one.
+    """
+    if TRACER is not None:
+        TRACER.begin_phase(name)
+
+
+def count(**values):
+    """
+    Set counters of the current phase, e.g. count(trees=100).
+    """
+    if TRACER is not None:
+        if TRACER.phase is not None:
+            TRACER.phase[2].update(values)
+        TRACER.counter("counters", **values)
+
+
+def span(name, start, **values):
+    """
+    Record a span inside the current phase, from the given start time to now, with counters.
+    """
+    if TRACER is not None:
+        TRACER.span(name, start, time.time(), values)
+
+
+def progress(done, total):
+    """
+    Report that done out of total parts of some work are completed (done = 0 when it begins).
+    """
+    if TRACER is not None and total > 0:
+        start = TRACER.progress[0] if TRACER.progress is not None and done > 0 else time.time()
+        TRACER.progress = (start, float(done) / total)
+
+
+def eta():
+    """
+    Estimated number of seconds to the end of the current work, or None if it is unknown.
+    """
+    if TRACER is None or TRACER.progress is None or TRACER.progress[1] == 0:
+        return None
+    start, fraction = TRACER.progress
+    return (time.time() - start) * (1 - fraction) / fraction
+
+
+def status():
+    """
+    Memory usage and estimated remaining time of the current work, to be appended to progress
+    messages (empty if instrumentation is disabled).
+    """
+    if TRACER is None:
+        return ""
+    remaining = eta()
+    return " [RSS %d MB%s]" % (current_rss() // 1024, ", ETA %d seconds" % remaining if remaining is not None else "")
@@ -0,0 +1,127 @@
+"""
+In-memory caches of the results of functions (memoization).
+
+A Memo is used like a dictionary, with a limit on the number of entries: when it is
+full, the entries that were not used recently are evicted. Eviction is by generations
+(an approximation of LRU which is cheap with plain dictionaries): new entries are
+stored in the young generation, and when it is full it becomes the old one,
+replacing the previous old generation; entries of the old generation that are used
+again are moved to the young one. Hits, misses and evictions are counted.
+
+A SharedTable is a read-only table of integers in shared memory. Built before a
+process pool is forked (see fork_pool in parallel.py), it is used by all workers
+without being copied. Workers started by spawn or forkserver do not inherit it.
+"""
+
+import ctypes
+import multiprocessing
+from array import array
+
+
+# all the memos, by name
+MEMOS = {}
+
+# maximum number of entries of every memo (None for no limit)
+LIMIT = None
+
+
+class Memo(dict):
+    """
+    Cache with at most LIMIT entries (see set_limit), used as:
+        if key not in memo:
+            memo[key] = f(key)
+        return memo[key]
+    The dictionary itself is the young generation, and the lookup is counted as a hit
+    or a miss by the membership test (which moves old entries to the young generation).
+    """
+    
+    def __init__(self, name):
+        dict.__init__(self)
+        self.name = name
+        self.limit = LIMIT
+        self.old = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        MEMOS[name] = self
+    
+    
+    def __contains__(self, key):
+        if dict.__contains__(self, key):
+            self.hits += 1
+            return True
+        if key in self.old:
+            self.hits += 1
+            self[key] = self.old.pop(key)
+            return True
+        self.misses += 1
+        return False
+    
+    
+    def __setitem__(self, key, value):
+        if self.limit is not None and dict.__len__(self) >= max(self.limit // 2, 1):
+            self.new_generation()
+        dict.__setitem__(self, key, value)
+    
+    
+    def __len__(self):
+        return dict.__len__(self) + len(self.old)
+    
+    
+    def new_generation(self):
+        """
+        Evict the old generation, and make the young generation old.
+        """
+        self.evictions += len(self.old)
+        self.old = dict(self)
+        dict.clear(self)
+    
+    
+    def clear(self):
+        dict.clear(self)
+        self.old = {}
+    
+    
+    def statistics(self):
+        """
+        Dictionary with the number of entries, hits, misses and evictions.
+        """
+        return {'entries': len(self), 'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions}
+
+
+def set_limit(limit):
+    """
+    Set the maximum number of entries of all memos (None for no limit).
+    """
+    global LIMIT
+    LIMIT = limit
+    for memo in MEMOS.values():
+        memo.limit = limit
+        while limit is not None and len(memo) > limit:
+            memo.new_generation()
+
+
+def statistics():
+    """
+    Statistics of all memos, by name.
+    """
+    return {name: memo.statistics() for name, memo in MEMOS.items()}
+
+
+class SharedTable(object):
+    """
+    Read-only table of integers in shared memory.
+    """
+    
+    def __init__(self, values, typecode='i'):
+        values = array(typecode, values)
+        self.data = multiprocessing.RawArray(typecode, len(values))
+        ctypes.memmove(self.data, values.buffer_info()[0], len(values) * values.itemsize)
+    
+    
+    def __getitem__(self, i):
+        return self.data[i]
+    
+    
+    def __len__(self):
+        return len(self.data)
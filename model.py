@@ -0,0 +1,221 @@
+"""
+Solver-independent feasibility models over binary variables.
+
+A Model stores its linear constraints compactly (as flat arrays of integers),
+grouped in named families, and can be used as a sink for emit (see constraints.py).
+Once built, a model can be written to an LP, MPS or DIMACS CNF file, or passed to any of the
+solvers in solvers.py.
+"""
+
+import bisect
+from array import array
+
+from constraints import merge_terms, var_name, LPWriter
+from cnf import DIMACSWriter
+
+
+SENSES = ['<=', '>=', '==']
+
+
+class Model(object):
+    """
+    Feasibility model with binary variables, identified by hashable keys.
+    """
+    
+    def __init__(self, name, variables, prefix='x'):
+        self.name = name
+        self.variables = list(variables)
+        self.prefix = prefix
+        self.ids = {var: i for i, var in enumerate(self.variables)}
+        
+        self.families = []          # list of [name, first row, end row]
+        self.senses = array('b')    # index in SENSES
+        self.rhs = array('i')
+        self.starts = array('I', [0])   # terms of row i are in [starts[i], starts[i+1])
+        self.columns = array('i')
+        self.coefficients = array('i')
+    
+    
+    def add_variables(self, variables):
+        """
+        Add new variables to the model.
+        """
+        for var in variables:
+            self.ids[var] = len(self.variables)
+            self.variables.append(var)
+    
+    
+    def __len__(self):
+        return len(self.senses)
+    
+    
+    def add_constraints(self, name, offset, batch):
+        """
+        Add a batch of constraints (terms, sense, rhs) to the family with the given name.
+        """
+        if len(self.families) == 0 or self.families[-1][0] != name or offset == 0:
+            self.families.append([name, len(self), len(self)])
+        
+        for terms, sense, rhs in batch:
+            for coef, var in merge_terms(terms):
+                self.columns.append(self.ids[var])
+                self.coefficients.append(coef)
+            self.starts.append(len(self.columns))
+            self.senses.append(SENSES.index(sense))
+            self.rhs.append(rhs)
+        
+        self.families[-1][2] = len(self)
+    
+    
+    def close(self):
+        pass
+    
+    
+    def truncate(self, size):
+        """
+        Remove all constraints but the first size ones.
+        """
+        del self.columns[self.starts[size]:]
+        del self.coefficients[self.starts[size]:]
+        del self.starts[size+1:]
+        del self.senses[size:]
+        del self.rhs[size:]
+        
+        self.families = [family for family in self.families if family[1] < size]
+        if len(self.families) > 0:
+            self.families[-1][2] = min(self.families[-1][2], size)
+    
+    
+    def row(self, i):
+        """
+        Constraint i, as a triple (terms, sense, rhs) with terms given by variable indices.
+        """
+        start, end = self.starts[i], self.starts[i+1]
+        return list(zip(self.coefficients[start:end], self.columns[start:end])), SENSES[self.senses[i]], self.rhs[i]
+    
+    
+    def constraints(self, start, end):
+        """
+        Generate the constraints in [start, end), as triples (terms, sense, rhs) with terms given by variable keys.
+        """
+        for i in range(start, end):
+            terms, sense, rhs = self.row(i)
+            yield [(coef, self.variables[j]) for coef, j in terms], sense, rhs
+    
+    
+    def violated(self, solution):
+        """
+        Generate the indices of the constraints violated by a solution (the set of variables with value 1).
+        """
+        values = array('b', (var in solution for var in self.variables))
+        for i in range(len(self)):
+            terms, sense, rhs = self.row(i)
+            activity = sum(coef * values[j] for coef, j in terms)
+            if not (activity <= rhs if sense == '<=' else activity >= rhs if sense == '>=' else activity == rhs):
+                yield i
+    
+    
+    def replay(self, sink, batch_size=100000):
+        """
+        Pass all constraints to another sink, family by family, in batches of batch_size.
+        """
+        for name, start, end in self.families:
+            for first in range(start, end, batch_size):
+                last = min(first + batch_size, end)
+                sink.add_constraints(name, first - start, list(self.constraints(first, last)))
+        sink.close()
+    
+    
+    def constraint_name(self, i):
+        """
+        Name of constraint i, e.g. meet1[5].
+        """
+        f = bisect.bisect_right([start for name, start, end in self.families], i) - 1
+        name, start, end = self.families[f]
+        return "%s[%d]" % (name, i - start)
+    
+    
+    def transpose(self):
+        """
+        Sort the terms of the constraints by variable (counting sort).
+        Return three arrays: the terms of variable j are at positions by_column[counts[j]:counts[j+1]]
+        of the arrays columns and coefficients, and the term at position k is in constraint rows[k].
+        """
+        counts = array('I', [0]) * (len(self.variables) + 1)
+        for j in self.columns:
+            counts[j+1] += 1
+        for j in range(len(self.variables)):
+            counts[j+1] += counts[j]
+        
+        position = array('I', counts)
+        by_column = array('I', [0]) * len(self.columns)
+        rows = array('I', [0]) * len(self.columns)
+        for i in range(len(self)):
+            for k in range(self.starts[i], self.starts[i+1]):
+                j = self.columns[k]
+                by_column[position[j]] = k
+                position[j] += 1
+                rows[k] = i
+        
+        return counts, by_column, rows
+    
+    
+    def names(self):
+        """
+        Names of the variables in LP and MPS files.
+        """
+        return [var_name(self.prefix, var) for var in self.variables]
+    
+    
+    def write_lp(self, path):
+        """
+        Write the model to a file in (CPLEX) LP format.
+        """
+        self.replay(LPWriter(path, self.variables, prefix=self.prefix, name=self.name))
+    
+    
+    def write_cnf(self, path):
+        """
+        Write the model to a file in DIMACS CNF format (see cnf.py).
+        The variables of the model are numbered 1, 2, ... in order.
+        """
+        self.replay(DIMACSWriter(path, self.variables))
+    
+    
+    def write_mps(self, path):
+        """
+        Write the model to a file in (free) MPS format.
+        Rows are named by their family and index, e.g. meet1_5.
+        """
+        names = self.names()
+        row_names = [None] * len(self)
+        for name, start, end in self.families:
+            for i in range(start, end):
+                row_names[i] = '%s_%d' % (name, i - start)
+        
+        counts, by_column, rows = self.transpose()
+        
+        with open(path, 'w') as f:
+            f.write("NAME          %s\n" % self.name)
+            f.write("ROWS\n")
+            f.write(" N  COST\n")
+            for i in range(len(self)):
+                f.write(" %s  %s\n" % ('LGE'[self.senses[i]], row_names[i]))
+            
+            f.write("COLUMNS\n")
+            f.write("    MARKER                 'MARKER'                 'INTORG'\n")
+            for j in range(len(self.variables)):
+                f.write("    %s  COST  0\n" % names[j])
+                for k in by_column[counts[j]:counts[j+1]]:
+                    f.write("    %s  %s  %d\n" % (names[j], row_names[rows[k]], self.coefficients[k]))
+            f.write("    MARKER                 'MARKER'                 'INTEND'\n")
+            
+            f.write("RHS\n")
+            for i in range(len(self)):
+                if self.rhs[i] != 0:
+                    f.write("    rhs  %s  %d\n" % (row_names[i], self.rhs[i]))
+            
+            f.write("BOUNDS\n")
+            for j in range(len(self.variables)):
+                f.write(" BV bnd  %s\n" % names[j])
+            f.write("ENDATA\n")
@@ -0,0 +1,95 @@
+"""
+Parallel generation of constraints with a process pool.
+
+The work is split into shards, i.e. consecutive ranges [start, end) of a list
+(for example, of possible triples). For every shard, a worker computes
+function(state, start, end), which returns the constraints of the shard as a
+flat array of integers (typically, indices of variables).
+Workers inherit the state of the parent process when the pool is forked, so
+only the shard bounds and the resulting arrays are sent between processes.
+The pools are always created with the fork start method (whatever the default start
+method of the platform is, e.g. spawn on macOS, or forkserver on Linux since Python 3.14),
+so process pools are only available on POSIX systems; with processes=1, nothing is forked.
+"""
+
+import multiprocessing
+from array import array
+
+import instrumentation
+
+
+SHARDS_PER_PROCESS = 16
+
+# state shared with the workers (set in every worker by _set_state)
+STATE = None
+
+
+def fork_pool(processes, state=None):
+    """
+    Process pool whose workers are forked, with the given state in STATE (without copying it).
+    """
+    return multiprocessing.get_context('fork').Pool(processes=processes, initializer=_set_state, initargs=(state,))
+
+
+def _set_state(state):
+    global STATE
+    STATE = state
+
+
+def _run_shard(args):
+    function, start, end = args
+    return function(STATE, start, end).tobytes()
+
+
+def shard_bounds(size, num_shards):
+    """
+    Split range(size) into at most num_shards consecutive ranges of similar length.
+    """
+    num_shards = max(1, min(num_shards, size))
+    return [(size * i // num_shards, size * (i+1) // num_shards) for i in range(num_shards)]
+
+
+def map_shards(function, state, size, processes=1, typecode='i'):
+    """
+    Generate the arrays function(state, start, end) for consecutive shards of range(size),
+    in order, computing them with the given number of processes.
+    function must be defined at the top level of a module.
+    """
+    bounds = shard_bounds(size, processes * SHARDS_PER_PROCESS)
+    instrumentation.progress(0, len(bounds))
+
+    if processes == 1:
+        for i, (start, end) in enumerate(bounds):
+            yield function(state, start, end)
+            instrumentation.progress(i+1, len(bounds))
+        return
+
+    process_pool = fork_pool(processes, state)
+    try:
+        for i, data in enumerate(process_pool.imap(_run_shard, [(function, start, end) for start, end in bounds])):
+            res = array(typecode)
+            res.frombytes(data)
+            yield res
+            instrumentation.progress(i+1, len(bounds))
+    finally:
+        process_pool.terminate()
+
+
+def rows(arrays, width):
+    """
+    Generate the rows (as tuples) of a sequence of flat arrays with the given number of columns.
+    """
+    for data in arrays:
+        for i in range(0, len(data), width):
+            yield tuple(data[i:i+width])
+
+
+def variable_rows(arrays):
+    """
+    Generate the rows (as tuples) of a sequence of flat arrays where every row is preceded by its length.
+    """
+    for data in arrays:
+        i = 0
+        while i < len(data):
+            yield tuple(data[i+1:i+1+data[i]])
+            i += data[i] + 1
@@ -0,0 +1,252 @@
+"""
+Presolve: cheap eliminations of variables before a model is solved.
+
+There are two stages.
+1. Before creating variables, candidate triples (t,r,s) are filtered by rules, each of
+   which states that t cannot be the consensus (or meet) of r and s.
+2. Once the constraints are built, the values forced by single constraints are
+   propagated until a fixpoint (for example: a pair with a single possible meet forces
+   that meet, which excludes all triples incompatible with it by extension stability,
+   and so on). The fixed variables are then removed from the model.
+
+Every elimination is recorded in a log, as a triple (variable, value, reason), where
+the reason is the name of a rule, or the name of a constraint, e.g. "meetexists[12]".
+An infeasible constraint is logged with variable and value None.
+"""
+
+import itertools
+from array import array
+from collections import Counter
+
+from tree import *
+from model import Model
+
+
+### rules on candidate triples ###
+
+def unanimity(index, triple):
+    """
+    (t,r,r) is possible only for t=r.
+    """
+    t, r, s = triple
+    return not (r == s and t != r)
+
+
+def different_orbits(index, triple):
+    """
+    t < r and t < s are not possible if t is in the same orbit as r or s.
+    """
+    t, r, s = triple
+    if t != r and index.normal[t] == index.normal[r]:
+        return False
+    if t != s and index.normal[t] == index.normal[s]:
+        return False
+    return True
+
+
+def pareto_on_triples(index, triple):
+    """
+    If r and s have the same restriction u to three leaves, and u is binary (i.e. not
+    the bottom element), then t must have restriction u too.
+    """
+    t, r, s = triple
+    for Y in itertools.combinations(index.X, 3):
+        restriction_Y = index.restriction_table(leaves_to_mask(Y))
+        u = restriction_Y[r]
+        if index.binary[u] and restriction_Y[s] == u and restriction_Y[t] != u:
+            return False
+    return True
+
+
+def symmetric_profile(index, triple):
+    """
+    The consensus of r and s is fixed by the permutations which map the profile (r,s)
+    to itself or to (s,r), since the consensus method is regular and the triples are
+    normalized up to exchanging r and s.
+    """
+    t, r, s = index.decode(triple)
+    isomorphisms = canonical_isomorphisms(r)
+    for u, v in [(r, s), (s, r)]:
+        if canonical_labelling(u)[0] != canonical_labelling(r)[0]:
+            continue
+        # the permutations which map r to u
+        inverse = {y: x for x, y in enumerate(canonical_isomorphisms(u)[0]) if x > 0}
+        for sigma in isomorphisms:
+            sigma = {x: inverse[sigma[x]] for x in leaf_set(r)}
+            if apply_permutation(s, sigma) == v and apply_permutation(t, sigma) != t:
+                return False
+    return True
+
+
+def first_violated_rule(index, triple, rules):
+    """
+    Index of the first rule that excludes the triple, or -1 if there is none.
+    """
+    for i, rule in enumerate(rules):
+        if not rule(index, triple):
+            return i
+    return -1
+
+
+def violated_rules_shard(state, start, end):
+    """
+    First rule violated by each of the triples in [start, end) (see parallel.py).
+    """
+    index, rules = state['index'], state['rules']
+    return array('b', (first_violated_rule(index, triple, rules) for triple in state['triples'][start:end]))
+
+
+def filter_triples(triples, violated, rules, log):
+    """
+    Keep the triples such that violated[i] == -1 (see first_violated_rule),
+    and log the eliminated ones.
+    """
+    res = []
+    for triple, i in zip(triples, violated):
+        if i == -1:
+            res.append(triple)
+        else:
+            log.append((triple, 0, rules[i].__name__))
+    return res
+
+
+### propagation on models ###
+
+def propagate(model, log, reasons=None):
+    """
+    Propagate the bounds of the constraints of the model, until a fixpoint.
+    Return an array with the value of every variable (-1 if it is not fixed),
+    or None if the constraints are infeasible.
+    If reasons is a dictionary, the index of the constraint which fixed each variable is
+    stored under the index of the variable, and the index of the infeasible constraint
+    under None.
+    """
+    values = array('b', [-1]) * len(model.variables)
+    
+    counts, by_column, rows = model.transpose()
+    
+    queue = list(range(len(model)))
+    queued = array('b', [1]) * len(model)
+    while len(queue) > 0:
+        i = queue.pop()
+        queued[i] = 0
+        forced = propagate_row(model, i, values)
+        if forced is None:
+            log.append((None, None, model.constraint_name(i)))
+            if reasons is not None:
+                reasons[None] = i
+            return None
+        
+        for j, value in forced:
+            values[j] = value
+            log.append((model.variables[j], value, model.constraint_name(i)))
+            if reasons is not None:
+                reasons[j] = i
+            # constraints containing the variable j
+            for k in by_column[counts[j]:counts[j+1]]:
+                i2 = rows[k]
+                if not queued[i2]:
+                    queued[i2] = 1
+                    queue.append(i2)
+    
+    return values
+
+
+def propagate_row(model, i, values):
+    """
+    Find the variables whose value is forced by constraint i, given the fixed values,
+    as a list of pairs (variable index, value). Return None if the constraint cannot be satisfied.
+    """
+    terms, sense, rhs = model.row(i)
+    forced = []
+    
+    # a constraint sum(a x) == b is both <= b and >= b, and sum(a x) >= b is sum(-a x) <= -b
+    for sign in ([1] if sense == '<=' else [-1] if sense == '>=' else [1, -1]):
+        bound = sign * rhs
+        free = []
+        min_activity = 0
+        for coef, j in terms:
+            coef *= sign
+            if values[j] >= 0:
+                min_activity += coef * values[j]
+            else:
+                free.append((coef, j))
+                min_activity += min(coef, 0)
+        
+        if min_activity > bound:
+            return None
+        for coef, j in free:
+            if min_activity + abs(coef) > bound:
+                # the variable must take the value which gives the minimum activity
+                forced.append((j, 0 if coef > 0 else 1))
+    
+    # the same variable may be forced twice (for == constraints)
+    forced = sorted(set(forced))
+    if len(set(j for j, value in forced)) < len(forced):
+        return None
+    return forced
+
+
+def reduce_model(model, values):
+    """
+    Build the model with the variables that are not fixed, removing the fixed variables from the
+    constraints and dropping the constraints that are always satisfied.
+    """
+    reduced = Model(model.name, [var for j, var in enumerate(model.variables) if values[j] == -1], prefix=model.prefix)
+    
+    for name, start, end in model.families:
+        batch = []
+        for i in range(start, end):
+            terms, sense, rhs = model.row(i)
+            free_terms = []
+            for coef, j in terms:
+                if values[j] >= 0:
+                    rhs -= coef * values[j]
+                else:
+                    free_terms.append((coef, model.variables[j]))
+            
+            if len(free_terms) == 0:
+                continue
+            max_activity = sum(max(coef, 0) for coef, var in free_terms)
+            min_activity = sum(min(coef, 0) for coef, var in free_terms)
+            if sense == '<=' and max_activity <= rhs or sense == '>=' and min_activity >= rhs:
+                continue
+            batch.append((free_terms, sense, rhs))
+        
+        if len(batch) > 0:
+            reduced.add_constraints(name, 0, batch)
+    
+    return reduced
+
+
+def presolve(model, log):
+    """
+    Propagate the constraints of the model, and remove the fixed variables.
+    Return the reduced model and the dictionary of fixed variables (with their values),
+    or (None, None) if the constraints are infeasible.
+    """
+    values = propagate(model, log)
+    if values is None:
+        return None, None
+    
+    fixed = {var: values[j] for j, var in enumerate(model.variables) if values[j] >= 0}
+    return reduce_model(model, values), fixed
+
+
+def write_log(path, log, decode):
+    """
+    Write the log of eliminations to a file, decoding variables with the given function.
+    """
+    with open(path, 'w') as f:
+        for var, value, reason in log:
+            if var is None:
+                f.write("infeasible: %s\n" % reason)
+            else:
+                f.write("%r = %d: %s\n" % (decode(var), value, reason))
+
+
+def summary(log):
+    """
+    Number of eliminated variables, by reason (rule or family of constraints).
+    """
+    return Counter(reason.split('[')[0] for var, value, reason in log if var is not None)
@@ -0,0 +1,391 @@
+"""
+Solvers for the feasibility models of model.py.
+
+Every solver finds up to a given number of distinct solutions of a model, and
+returns them as a list of sets of variables (the ones with value 1). The list
+is empty if the model is infeasible.
+Available solvers are Gurobi (through gurobipy), CBC and HiGHS (through
+their command-line programs, which must be in the PATH), and SAT solvers
+(through the CNF encoding of cnf.py).
+
+Models can also have lazy constraints, which are too many to be generated in
+advance: they are separated from the solutions found, and added only when
+violated (see Solver.solve_lazily).
+"""
+
+import os
+import sys
+import itertools
+import shutil
+import tempfile
+import subprocess
+
+from cnf import read_assignment
+
+
+class SolverError(Exception):
+    pass
+
+
+def trivial_solutions(model):
+    """
+    Solutions of a model without variables.
+    """
+    return [set()] if next(model.violated(set()), None) is None else []
+
+
+class Solver(object):
+    """
+    Base class of solvers that find one solution at a time.
+    Further solutions are found by adding no-good constraints, which exclude
+    the solutions found so far.
+    """
+    
+    def solve(self, model, threads=1, solutions=1, start=None):
+        """
+        Find up to the given number of distinct solutions of the model.
+        start is a partial solution (a dictionary from variables to values), used as a hint
+        by the solvers which support it.
+        """
+        if len(model.variables) == 0:
+            return trivial_solutions(model)
+        
+        size = len(model)
+        res = []
+        try:
+            while len(res) < solutions:
+                solution = self.find_solution(model, threads, start)
+                if solution is None:
+                    break
+                res.append(solution)
+                
+                # at least one variable must change its value
+                terms = [(-1 if var in solution else 1, var) for var in model.variables]
+                model.add_constraints("nogood", len(res) - 1, [(terms, '>=', 1 - len(solution))])
+        finally:
+            model.truncate(size)
+        
+        return res
+    
+    
+    def find_solution(self, model, threads, start=None):
+        """
+        Find one solution of the model, or return None if it is infeasible.
+        """
+        raise NotImplementedError
+    
+    
+    def solve_lazily(self, model, separate, threads=1, solutions=1):
+        """
+        Find up to the given number of distinct solutions of the model and of lazy constraints.
+        separate(solution, processes) returns the lazy constraints violated by a solution, as a
+        list of pairs (family name, list of constraints), using up to the given number of processes.
+        The model is solved, the lazy constraints violated by its solutions are added to it (in
+        families named e.g. trans_1, trans_2, ... by round), and so on until no constraint is violated.
+        """
+        for iteration in itertools.count(1):
+            res = self.solve(model, threads=threads, solutions=solutions)
+            
+            # the same constraint may be violated by more than one solution
+            cuts = {}
+            for solution in res:
+                for name, constraints in separate(solution, threads):
+                    cuts.setdefault(name, set()).update((tuple(terms), sense, rhs) for terms, sense, rhs in constraints)
+            cuts = {name: sorted(constraints) for name, constraints in cuts.items() if len(constraints) > 0}
+            if len(cuts) == 0:
+                return res
+            
+            print("Round %d: %s violated" % (iteration, ', '.join("%d %s" % (len(cuts[name]), name) for name in sorted(cuts))))
+            for name in sorted(cuts):
+                model.add_constraints("%s_%d" % (name, iteration), 0, [(list(terms), sense, rhs) for terms, sense, rhs in cuts[name]])
+
+
+class GurobiSolver(Solver):
+    """
+    Gurobi, through gurobipy. Multiple solutions are found with the solution pool,
+    and the partial solution given as start is used as a MIP start.
+    """
+    
+    def build(self, model, threads):
+        """
+        Gurobi model with the variables and constraints of the model.
+        Return the Gurobi model and the sink which adds constraints to it.
+        """
+        import gurobipy
+        from constraints import GurobiSink
+        
+        grb_model = gurobipy.Model(model.name)
+        x = grb_model.addVars(model.variables, name=model.prefix, vtype=gurobipy.GRB.BINARY)
+        sink = GurobiSink(grb_model, x)
+        model.replay(sink)
+        grb_model.setParam("Threads", threads)
+        return grb_model, sink
+    
+    
+    def solve(self, model, threads=1, solutions=1, start=None):
+        if len(model.variables) == 0:
+            return trivial_solutions(model)
+        
+        import gurobipy
+        
+        grb_model, sink = self.build(model, threads)
+        x = sink.variables
+        
+        if start is not None:
+            for var, value in start.items():
+                x[var].Start = value
+        
+        if solutions > 1:
+            grb_model.setParam("PoolSearchMode", 2)
+            grb_model.setParam("PoolSolutions", solutions)
+        
+        grb_model.optimize()
+        
+        if grb_model.Status == gurobipy.GRB.INFEASIBLE:
+            return []
+        if grb_model.SolCount == 0:
+            raise SolverError("Gurobi terminated with status %d" % grb_model.Status)
+        
+        res = []
+        for k in range(grb_model.SolCount):
+            grb_model.setParam("SolutionNumber", k)
+            res.append(set(var for var, v in x.items() if v.Xn > 0.5))
+        return res
+    
+    
+    def solve_lazily(self, model, separate, threads=1, solutions=1):
+        """
+        Lazy constraints are separated from every incumbent solution in a callback, and are not
+        added to the model. Further solutions are found with no-good constraints.
+        The callback runs inside the (multithreaded) optimization, so it separates in this
+        process only: forking a process pool there, at every incumbent, is slow and unsafe.
+        """
+        if len(model.variables) == 0:
+            return Solver.solve_lazily(self, model, separate, threads, solutions)
+        
+        import gurobipy
+        
+        grb_model, sink = self.build(model, threads)
+        grb_model.setParam("LazyConstraints", 1)
+        grb_variables = [sink.variables[var] for var in model.variables]
+        
+        def callback(grb_model, where):
+            if where == gurobipy.GRB.Callback.MIPSOL:
+                values = grb_model.cbGetSolution(grb_variables)
+                solution = set(var for var, value in zip(model.variables, values) if value > 0.5)
+                for name, constraints in separate(solution, 1):
+                    for terms, sense, rhs in constraints:
+                        grb_model.cbLazy(sink.constraint(terms, sense, rhs))
+        
+        res = []
+        while len(res) < solutions:
+            grb_model.optimize(callback)
+            if grb_model.Status == gurobipy.GRB.INFEASIBLE:
+                break
+            if grb_model.SolCount == 0:
+                raise SolverError("Gurobi terminated with status %d" % grb_model.Status)
+            
+            solution = set(var for var, v in zip(model.variables, grb_variables) if v.X > 0.5)
+            res.append(solution)
+            terms = [(-1 if var in solution else 1, var) for var in model.variables]
+            grb_model.addConstr(sink.constraint(terms, '>=', 1 - len(solution)), "nogood[%d]" % (len(res) - 1))
+        
+        return res
+
+
+class CommandLineSolver(Solver):
+    """
+    Solver that reads the model from an MPS file and writes the solution to a file.
+    """
+    
+    executable = None
+    
+    def __init__(self, executable=None):
+        if executable is not None:
+            self.executable = executable
+    
+    
+    def find_solution(self, model, threads, start=None):
+        path = shutil.which(self.executable)
+        if path is None:
+            raise SolverError("%s not found in the PATH" % self.executable)
+        
+        directory = tempfile.mkdtemp()
+        try:
+            model_path = os.path.join(directory, 'model.mps')
+            solution_path = os.path.join(directory, 'solution.txt')
+            model.write_mps(model_path)
+            
+            start_path = None
+            if start is not None:
+                start_path = os.path.join(directory, 'start.txt')
+                names = {var: name for var, name in zip(model.variables, model.names())}
+                with open(start_path, 'w') as f:
+                    self.write_start(f, [(names[var], value) for var, value in start.items() if var in names])
+            
+            status = subprocess.call(self.command(path, directory, model_path, solution_path, threads, start_path))
+            if status != 0 or not os.path.exists(solution_path):
+                raise SolverError("%s terminated with exit status %d" % (self.executable, status))
+            
+            with open(solution_path) as f:
+                values = self.read_solution(f)
+        finally:
+            shutil.rmtree(directory)
+        
+        if values is None:
+            return None
+        ids = {name: var for name, var in zip(model.names(), model.variables)}
+        return set(ids[name] for name, value in values if value > 0.5)
+    
+    
+    def command(self, path, directory, model_path, solution_path, threads, start_path):
+        """
+        Command line that solves the model.
+        """
+        raise NotImplementedError
+    
+    
+    def write_start(self, f, values):
+        """
+        Write the pairs (variable name, value) of a partial solution, used as a starting point.
+        Solvers that do not support starting points ignore it.
+        """
+        pass
+    
+    
+    def read_solution(self, f):
+        """
+        Read the pairs (variable name, value) from the solution file, or return None if the model is infeasible.
+        """
+        raise NotImplementedError
+
+
+class CBCSolver(CommandLineSolver):
+    """
+    COIN-OR CBC (https://github.com/coin-or/Cbc).
+    """
+    
+    executable = 'cbc'
+    
+    def command(self, path, directory, model_path, solution_path, threads, start_path):
+        start = ['mipstart', start_path] if start_path is not None else []
+        return [path, model_path] + start + ['threads', str(threads), 'solve', 'solution', solution_path]
+    
+    
+    def write_start(self, f, values):
+        # same format as the solution file
+        f.write("Feasible - objective value 0\n")
+        for i, (name, value) in enumerate(values):
+            f.write("%d %s %d 0\n" % (i, name, value))
+    
+    
+    def read_solution(self, f):
+        # the first line is the status, and the following ones are: index, name, value, reduced cost
+        status = f.readline()
+        if 'infeasible' in status.lower():
+            return None
+        if not status.startswith('Optimal'):
+            raise SolverError("CBC terminated with status: %s" % status.strip())
+        
+        values = []
+        for line in f:
+            fields = line.split()
+            if fields[0] == '**':
+                # nonzero value of a variable that should be integer
+                fields = fields[1:]
+            values.append((fields[1], float(fields[2])))
+        return values
+
+
+class HiGHSSolver(CommandLineSolver):
+    """
+    HiGHS (https://highs.dev).
+    """
+    
+    executable = 'highs'
+    
+    def command(self, path, directory, model_path, solution_path, threads, start_path):
+        options_path = os.path.join(directory, 'options.txt')
+        with open(options_path, 'w') as f:
+            f.write("threads = %d\n" % threads)
+        return [path, '--model_file', model_path, '--options_file', options_path, '--solution_file', solution_path]
+    
+    
+    def read_solution(self, f):
+        lines = [line.strip() for line in f]
+        status = lines[lines.index('Model status') + 1]
+        if status == 'Infeasible':
+            return None
+        if status != 'Optimal':
+            raise SolverError("HiGHS terminated with status: %s" % status)
+        
+        # primal values are in a section starting with "# Columns <number of columns>"
+        i = next(i for i, line in enumerate(lines) if line.startswith('# Columns'))
+        values = []
+        for line in lines[i+1 : i+1+int(lines[i].split()[2])]:
+            name, value = line.split()[:2]
+            values.append((name, float(value)))
+        return values
+
+
+class SATSolver(Solver):
+    """
+    SAT solver which reads a DIMACS CNF file and writes the result in the format of the
+    SAT competitions (e.g. kissat, cadical, cryptominisat5, picosat).
+    The first of executables found in the PATH is used.
+    """
+    
+    executables = ['kissat', 'cadical', 'cryptominisat5', 'picosat']
+    
+    def __init__(self, executable=None):
+        if executable is not None:
+            self.executables = [executable]
+    
+    
+    def find_solution(self, model, threads, start=None):
+        path = next((path for path in (shutil.which(name) for name in self.executables) if path is not None), None)
+        if path is None:
+            raise SolverError("no SAT solver (%s) found in the PATH" % ', '.join(self.executables))
+        
+        directory = tempfile.mkdtemp()
+        try:
+            cnf_path = os.path.join(directory, 'model.cnf')
+            model.write_cnf(cnf_path)
+            
+            process = subprocess.Popen([path, cnf_path], stdout=subprocess.PIPE, universal_newlines=True)
+            output = []
+            for line in process.stdout:
+                if line.startswith('v '):
+                    output.append(line)
+                else:
+                    # show the log of the solver
+                    sys.stdout.write(line)
+                    if line.startswith('s '):
+                        output.append(line)
+            process.wait()
+        finally:
+            shutil.rmtree(directory)
+        
+        # exit status 10 means satisfiable, and 20 unsatisfiable
+        if process.returncode not in (10, 20):
+            raise SolverError("%s terminated with exit status %d" % (path, process.returncode))
+        
+        true_variables = read_assignment(output)
+        if true_variables is None:
+            return None
+        return set(var for i, var in enumerate(model.variables) if i+1 in true_variables)
+
+
+SOLVERS = {
+    'gurobi': GurobiSolver,
+    'cbc': CBCSolver,
+    'highs': HiGHSSolver,
+    'sat': SATSolver,
+}
+
+
+def get_solver(name):
+    """
+    Create the solver with the given name (one of the keys of SOLVERS).
+    """
+    return SOLVERS[name]()
@@ -1,6 +1,31 @@
+import os
+import sys
+import json
+import hashlib
+import shutil
+import tempfile
 import unittest
+import itertools
+import subprocess
+import multiprocessing
+from array import array
 
 from tree import *
+import cache
+from index import TreeIndex
+import memo
+from constraints import emit, merge_terms, LPWriter
+from parallel import map_shards, shard_bounds, rows, variable_rows
+from model import Model
+from core import infeasible_subset, minimize, subsystem, families, write_core
+from solvers import Solver, CBCSolver, SATSolver
+from cnf import encode, read_assignment
+import instrumentation
+from benchmark import run_benchmark, compare_results
+from extension import extension_stability_shard
+from certificate import write_certificate, read_certificate, expand
+from verify import verify
+from presolve import unanimity, pareto_on_triples, symmetric_profile, filter_triples, first_violated_rule, presolve, summary
 
 
 class TestTree(unittest.TestCase):
@@ -48,6 +73,38 @@ class TestTree(unittest.TestCase):
                 ((1,3),(2,4)),
                 ((1,4),(2,3)),
         ]))
+        
+        # number of trees on n leaves
+        for n, count in [(1, 1), (5, 236), (6, 2752)]:
+            trees = list(all_trees(range(1, n+1)))
+            self.assertEqual(len(trees), count)
+            self.assertEqual(trees, sorted(set(trees), key=tree_key))
+        
+        self.assertEqual(list(all_trees([7,3,1])), sorted(all_trees([1,3,7]), key=tree_key))
+        self.assertEqual(list(all_trees([1,2,3,4], encoding='id')), list(range(26)))
+        self.assertEqual([tuple(masks) for masks in all_trees([1,2,3,4,5], encoding='masks')], [tuple(sorted(cluster_masks(t))) for t in all_trees([1,2,3,4,5])])
+        
+        # binary trees: (2n-3)!! on n leaves
+        for n, count in [(3, 3), (5, 105), (6, 945)]:
+            self.assertEqual(list(all_trees(range(1, n+1), binary=True)), [t for t in all_trees(range(1, n+1)) if is_binary(t)])
+            self.assertEqual(len(list(all_trees(range(1, n+1), binary=True))), count)
+        ids = tree_ids([1,2,3,4])
+        self.assertEqual(list(all_trees([1,2,3,4], encoding='id', binary=True)), [ids[t] for t in all_trees([1,2,3,4]) if is_binary(t)])
+    
+    
+    def test_set_partitions(self):
+        # Bell numbers
+        self.assertEqual([sum(1 for a in restricted_growth_strings(n)) for n in range(8)], [1, 1, 2, 5, 15, 52, 203, 877])
+        self.assertEqual(list(set_partitions([1,2,3])), [[[1,2,3]], [[1,2],[3]], [[1,3],[2]], [[1],[2,3]], [[1],[2],[3]]])
+        partitions = [sorted(map(tuple, p)) for p in set_partitions([1,2,3,4,5])]
+        self.assertEqual(len(set(map(tuple, partitions))), 52)
+        for p in partitions:
+            self.assertEqual(sorted(itertools.chain.from_iterable(p)), [1,2,3,4,5])
+    
+    
+    def test_tree_key(self):
+        self.assertEqual(sorted(all_trees([1,2,3]), key=tree_key), [(1,2,3), (1,(2,3)), (2,(1,3)), (3,(1,2))])
+        self.assertEqual(sorted([((1,2),(3,4)), (1,(2,(3,4))), (1,2,(3,4)), 1], key=tree_key), [1, (1,2,(3,4)), (1,(2,(3,4))), ((1,2),(3,4))])
     
     
     def test_leaf_set(self):
@@ -60,7 +117,7 @@ class TestTree(unittest.TestCase):
     
     
     def test_clusters(self):
-        for i in xrange(2):
+        for i in range(2):
             self.assertEqual(set(clusters((1,2))), set([
                 (1,),
                 (2,),
@@ -105,8 +162,24 @@ class TestTree(unittest.TestCase):
             ]))
     
     
+    def test_cluster_masks(self):
+        self.assertEqual(cluster_masks(3), frozenset([0b1000]))
+        self.assertEqual(cluster_masks((1,(2,3))), frozenset([0b10, 0b100, 0b1000, 0b1100, 0b1110]))
+        self.assertEqual(cluster_masks((1,2,3,4)), frozenset([0b10, 0b100, 0b1000, 0b10000, 0b11110]))
+        self.assertEqual(leaf_mask((1,(3,4,(2,6)))), 0b1011110)
+        self.assertEqual(mask_to_leaves(0b1011110), [1,2,3,4,6])
+        self.assertEqual(leaves_to_mask([1,2,3,4,6]), 0b1011110)
+    
+    
+    def test_masks_to_tree(self):
+        self.assertEqual(masks_to_tree([]), None)
+        self.assertEqual(masks_to_tree([0b100]), 2)
+        for t in all_trees([1,2,3,4,5]):
+            self.assertEqual(masks_to_tree(cluster_masks(t)), t)
+    
+    
     def test_compare(self):
-        for i in xrange(2):
+        for i in range(2):
             self.assertTrue(compare((1,2,3), (1,(2,3))))
             self.assertTrue(compare((1,2,3), (2,(1,3))))
             self.assertTrue(compare((1,2,3), (3,(1,2))))
@@ -130,6 +203,14 @@ class TestTree(unittest.TestCase):
         self.assertEqual(restriction((1,(2,3,(4,5))), [1,2,3,4,5]), (1,(2,3,(4,5))))
     
     
+    def test_refinement_matrix(self):
+        trees = sorted(all_trees([1,2,3,4]), key=tree_key)
+        R = refinement_matrix(trees)
+        for i, t in enumerate(trees):
+            for j, s in enumerate(trees):
+                self.assertEqual(R[i] >> j & 1, compare(s, t))
+    
+    
     def test_is_binary(self):
         self.assertTrue(is_binary((1,2)))
         self.assertTrue(is_binary((1,(2,3))))
@@ -149,8 +230,26 @@ class TestTree(unittest.TestCase):
         self.assertEqual(apply_permutation((1,2,(3,4,5)), {1: 1, 2: 2, 3: 7, 4: 8, 5: 9}), (1,2,(7,8,9)))
     
     
+    def test_canonical_labelling(self):
+        self.assertEqual(canonical_labelling((3,(1,2))), ((1,(2,3)), [3,1,2]))
+        self.assertEqual(canonical_labelling(((4,(3,5)),(1,2))), (((1,2),(3,(4,5))), [1,2,4,3,5]))
+        
+        for t in all_trees([1,2,3,4,5]):
+            form = min((apply_permutation(t, sigma) for sigma in all_permutations([1,2,3,4,5])), key=tree_key)
+            self.assertEqual(canonical_labelling(t)[0], form)
+            self.assertEqual(len(canonical_isomorphisms(t)), len([sigma for sigma in all_permutations([1,2,3,4,5]) if apply_permutation(t, sigma) == form]))
+            for sigma in canonical_isomorphisms(t):
+                self.assertEqual(apply_permutation(t, sigma), form)
+    
+    
+    def test_twin_classes(self):
+        self.assertEqual(twin_classes(((1,2,(3,4)),)), [[1,2], [3,4]])
+        self.assertEqual(twin_classes(((1,2,(3,4)), (1,(2,3,4)))), [[1], [2], [3,4]])
+        self.assertEqual(twin_classes(((1,2,3), (1,(2,3)), (1,2,3))), [[1], [2,3]])
+    
+    
     def test_normalize_tree(self):
-        for i in xrange(2):
+        for i in range(2):
             self.assertEqual(normalize_tree((1,2,3)), (1,2,3))
             self.assertEqual(normalize_tree((1,(2,3))), (1,(2,3)))
             self.assertEqual(normalize_tree((3,(1,2))), (1,(2,3)))
@@ -163,7 +262,7 @@ class TestTree(unittest.TestCase):
 
 
     def test_normalize_tuple(self):
-        for i in xrange(2):
+        for i in range(2):
             self.assertEqual(normalize_tuple(
                 ((3,(1,2)), (2,(1,3)))
             ),  ((1,(2,3)), (2,(1,3))))
@@ -176,6 +275,778 @@ class TestTree(unittest.TestCase):
                 ((3,(1,2)), (2,(1,3)), (1,2,3))
             ),  ((1,(2,3)), (1,2,3), (2,(1,3))))
         
+        # compare with the smallest element of the orbit
+        X = [1,2,3,4]
+        trees = list(all_trees(X))
+        for t in trees:
+            for r in trees:
+                orbit = [tuple(apply_permutation(u, sigma) for u in (t,r)) for sigma in all_permutations(X)]
+                self.assertEqual(normalize_tuple((t,r)), min(orbit, key=tree_key))
+    
+    
+    def test_automorphisms(self):
+        self.assertEqual(len(automorphisms((1,2,3,4))), 24)
+        self.assertEqual(len(automorphisms((1,(2,(3,4))))), 2)
+        self.assertEqual(len(automorphisms(((1,2),(3,4)))), 8)
+        for sigma in automorphisms((1,2,(3,4))):
+            self.assertEqual(apply_permutation((1,2,(3,4)), sigma), (1,2,(3,4)))
+    
+    
+    def test_generate_normal_tuples(self):
+        X = [1,2,3,4]
+        trees = list(all_trees(X))
+        for t in set(normalize_tree(u) for u in trees):
+            pairs = list(generate_normal_pairs(t))
+            self.assertEqual(len(pairs), len(set(pairs)))
+            self.assertEqual(set(pairs), set(normalize_tuple((t,r)) for r in trees))
+            
+            triples = list(generate_normal_triples(t))
+            self.assertEqual(len(triples), len(set(triples)))
+            self.assertEqual(set(triples), set(normalize_tuple((t,r,s)) for r in trees for s in trees))
+        
+        normal_trees, normal_pairs, normal_triples = find_normal_forms([1,2,3,4,5])
+        self.assertEqual((len(normal_trees), len(normal_pairs), len(normal_triples)), (12, 757, 62239))
+        
+        # profiles of binary trees
+        binary_forms = find_normal_forms([1,2,3,4,5], binary=True)
+        self.assertEqual(binary_forms[0], normal_trees)
+        self.assertEqual(binary_forms[1], [(r,s) for (r,s) in normal_pairs if is_binary(r) and is_binary(s)])
+        self.assertEqual(binary_forms[2], [(t,r,s) for (t,r,s) in normal_triples if is_binary(r) and is_binary(s)])
+    
+    
+    def test_encoded_normal_forms(self):
+        X = [1,2,3,4]
+        trees = sorted(all_trees(X), key=tree_key)
+        self.assertEqual(tree_ids(X), {t: i for i, t in enumerate(trees)})
+        
+        normal_trees, normal_pairs, normal_triples = find_normal_forms(X)
+        for processes in [1, 2]:
+            encoded = find_encoded_normal_forms(X, processes=processes, typecode='H')
+            self.assertEqual([data.typecode for data in encoded], ['H'] * 3)
+            self.assertEqual(list(encoded[0]), [trees.index(t) for t in normal_trees])
+            self.assertEqual(list(encoded[1]), [trees.index(t) for pair in normal_pairs for t in pair])
+            self.assertEqual(list(encoded[2]), [trees.index(t) for triple in normal_triples for t in triple])
+        self.assertEqual(normal_pairs, sorted(normal_pairs, key=tree_key))
+        
+
+
+class TestTreeIndex(unittest.TestCase):
+    
+    def setUp(self):
+        self.index = TreeIndex(4)
+    
+    
+    def test_ids(self):
+        index = self.index
+        self.assertEqual(len(index), 4 + 6*1 + 4*4 + 26)
+        self.assertEqual([index.trees[i] for i in index.trees_on([1,2,3])], sorted(all_trees([1,2,3]), key=tree_key))
+        for i, t in enumerate(index.trees):
+            self.assertEqual(index.ids[t], i)
+            self.assertEqual(index.leaves[i], leaf_mask(t))
+            self.assertEqual(index.binary[i], is_binary(t))
+            self.assertEqual(index.trees[index.normal[i]], normalize_tree(t))
+    
+    
+    def test_restriction(self):
+        index = self.index
+        for i, t in enumerate(index.trees):
+            for Y in powerset([1,2,3,4]):
+                j = index.restriction(i, Y)
+                self.assertEqual(index.trees[j] if j >= 0 else None, restriction(t, Y))
+    
+    
+    def test_normalize(self):
+        index = self.index
+        tup = ((3,(1,2)), (2,(1,3)), (1,2,3))
+        self.assertEqual(index.decode(index.normalize(index.encode(tup))), normalize_tuple(tup))
+        self.assertTrue(index.compare(index.ids[(1,2,3)], index.ids[(1,(2,3))]))
+        self.assertFalse(index.compare(index.ids[(1,(2,3))], index.ids[(1,2,3)]))
+    
+    
+    def test_pair_table(self):
+        for processes in [1, 2]:
+            index = TreeIndex(4)
+            index.share_pair_table(processes=processes)
+            for i in index.trees_on([1,2,3,4]):
+                for j in index.trees_on([1,2,3,4]):
+                    self.assertEqual(index.decode(index.normalize((i,j))), normalize_tuple(index.decode((i,j))))
+            self.assertEqual(len(index.normal_tuples), 0)
+            
+            pair = index.encode(((1,(2,3)), (2,(1,3))))
+            self.assertEqual(index.decode(index.normalize(pair)), normalize_tuple(index.decode(pair)))
+    
+    
+    def test_normal_tuples_memo(self):
+        # the memos of indices on different numbers of leaves are counted separately
+        index = TreeIndex(3)
+        self.assertIs(memo.MEMOS['TreeIndex(3).normal_tuples'], index.normal_tuples)
+        self.assertIs(memo.MEMOS['TreeIndex(4).normal_tuples'], self.index.normal_tuples)
+
+
+class TestMemo(unittest.TestCase):
+    
+    def tearDown(self):
+        memo.set_limit(None)
+    
+    
+    def test_memo(self):
+        squares = memo.Memo('squares')
+        for x in [1, 2, 1, 3, 1]:
+            if x not in squares:
+                squares[x] = x*x
+            self.assertEqual(squares[x], x*x)
+        self.assertEqual(squares.statistics(), {'entries': 3, 'hits': 2, 'misses': 3, 'evictions': 0})
+        
+        # generations of 2 entries
+        memo.set_limit(4)
+        for x in range(4, 10):
+            if x not in squares:
+                squares[x] = x*x
+        self.assertEqual(len(squares), 4)
+        self.assertEqual(squares.evictions, 5)
+        self.assertNotIn(1, squares)
+        self.assertIn(8, squares)
+        self.assertEqual(memo.statistics()['squares']['entries'], 4)
+        
+        memo.set_limit(1)
+        self.assertEqual(len(squares), 0)
+    
+    
+    def test_shared_table(self):
+        table = memo.SharedTable(range(10, 20))
+        self.assertEqual(len(table), 10)
+        self.assertEqual([table[i] for i in range(10)], list(range(10, 20)))
+
+
+class TestCache(unittest.TestCase):
+    
+    def setUp(self):
+        self.cache_dir = cache.CACHE_DIR
+        cache.CACHE_DIR = tempfile.mkdtemp()
+    
+    
+    def tearDown(self):
+        shutil.rmtree(cache.CACHE_DIR)
+        cache.CACHE_DIR = self.cache_dir
+    
+    
+    def test_cached_normal_forms(self):
+        X = [1,2,3,4]
+        computed = cache.cached_normal_forms(4)
+        self.assertEqual(computed, [sorted(all_trees(X), key=tree_key)] + list(find_normal_forms(X)))
+        self.assertTrue(os.path.exists(cache.cache_path(4, 'normal_triples')))
+        self.assertEqual(cache.cached_normal_forms(4), computed)
+        
+        computed = cache.cached_normal_forms(4, binary=True)
+        self.assertEqual(computed, [sorted(all_trees(X), key=tree_key)] + list(find_normal_forms(X, binary=True)))
+        self.assertTrue(os.path.exists(cache.cache_path(4, 'binary_normal_triples')))
+        self.assertEqual(cache.cached_normal_forms(4, binary=True), computed)
+        self.assertNotEqual(cache.cached_normal_forms(4), computed)
+    
+    
+    def test_cached_refinement_matrix(self):
+        R = cache.cached_refinement_matrix(5)
+        self.assertEqual(R, refinement_matrix(sorted(all_trees([1,2,3,4,5]), key=tree_key)))
+        self.assertEqual(cache.load_refinement_matrix(5), R)
+    
+    
+    def test_stale_cache(self):
+        cache.cached_normal_forms(3)
+        self.assertNotEqual(cache.read_array(3, 'normal_pairs'), None)
+        
+        cache.CACHE_VERSION += 1
+        try:
+            self.assertEqual(cache.read_array(3, 'normal_pairs'), None)
+            self.assertEqual(cache.load_trees(3), None)
+        finally:
+            cache.CACHE_VERSION -= 1
+    
+    
+    def test_cached_solution(self):
+        self.assertEqual(cache.load_solution(4, 'extension_solution'), False)
+        
+        solution = set([((1,2,3), (1,(2,3)), (2,(1,3))), (((1,2),(3,4)),)*3])
+        cache.save_solution(4, 'extension_solution', solution)
+        self.assertEqual(cache.load_solution(4, 'extension_solution'), solution)
+        
+        cache.save_solution(4, 'extension_solution', None)
+        self.assertEqual(cache.load_solution(4, 'extension_solution'), None)
+        
+        # a proof of infeasibility for an older model is not trusted
+        cache.KIND_VERSIONS['extension_solution'] += 1
+        try:
+            self.assertEqual(cache.load_solution(4, 'extension_solution'), False)
+        finally:
+            cache.KIND_VERSIONS['extension_solution'] -= 1
+    
+    
+    def test_cached_restriction_index(self):
+        index = TreeIndex(4, cached=True)
+        data = index.load_restriction_index()
+        self.assertEqual(data, TreeIndex(4).build_restriction_index())
+        self.assertTrue(os.path.exists(cache.cache_path(4, 'restrictions')))
+        
+        # the second index loads it from the cache
+        def build():
+            raise AssertionError("the restriction index should be loaded from the cache")
+        self.assertEqual(cache.cached_restriction_index(4, build), data)
+        self.assertEqual(TreeIndex(4, cached=True).restriction_table(leaves_to_mask([1,2])), TreeIndex(4).restriction_table(leaves_to_mask([1,2])))
+
+
+
+class ListSink(object):
+    
+    def __init__(self):
+        self.batches = []
+    
+    
+    def add_constraints(self, name, offset, batch):
+        self.batches.append((name, offset, list(batch)))
+    
+    
+    def close(self):
+        pass
+
+
+class TestConstraints(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    
+    def test_emit(self):
+        sink = ListSink()
+        constraints = (([(1, i), (1, i+1)], '<=', 1) for i in range(10))
+        self.assertEqual(emit(sink, "c", constraints, batch_size=4, verbose=False), 10)
+        self.assertEqual([(name, offset, len(batch)) for name, offset, batch in sink.batches], [("c", 0, 4), ("c", 4, 4), ("c", 8, 2)])
+        self.assertEqual(sink.batches[2][2][1], ([(1, 9), (1, 10)], '<=', 1))
+    
+    
+    def test_merge_terms(self):
+        self.assertEqual(merge_terms([(1, 'a'), (1, 'b'), (-1, 'a'), (2, 'c'), (1, 'c')]), [(1, 'b'), (3, 'c')])
+    
+    
+    def test_lp_writer(self):
+        path = os.path.join(self.directory, 'test.lp')
+        writer = LPWriter(path, [(1,2), (3,4)], prefix='m', name='test')
+        emit(writer, "c", [([(1, (1,2)), (-1, (3,4))], '<=', 0), ([(1, (1,2)), (1, (3,4))], '==', 1)], verbose=False)
+        writer.close()
+        
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines, [
+            "\\ Problem: test",
+            "Minimize",
+            " obj: 0 m_1_2",
+            "Subject To",
+            " c_0: + 1 m_1_2 - 1 m_3_4 <= 0",
+            " c_1: + 1 m_1_2 + 1 m_3_4 = 1",
+            "Binaries",
+            " m_1_2",
+            " m_3_4",
+            "End",
+        ])
+
+
+class EnumerationSolver(Solver):
+    """
+    Solver that tries all assignments, for tests.
+    """
+    
+    def find_solution(self, model, threads, start=None):
+        for values in itertools.product([0, 1], repeat=len(model.variables)):
+            solution = set(var for var, value in zip(model.variables, values) if value)
+            if next(model.violated(solution), None) is None:
+                return solution
+        return None
+
+
+class TestModel(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    
+    def example(self):
+        # exactly one of a, b, c, and a implies b
+        model = Model('test', ['a', 'b', 'c'])
+        emit(model, "one", [([(1, 'a'), (1, 'b'), (1, 'c')], '==', 1)], verbose=False)
+        emit(model, "impl", [([(1, 'a'), (-1, 'b')], '<=', 0)], verbose=False)
+        return model
+    
+    
+    def test_replay(self):
+        model = self.example()
+        self.assertEqual(len(model), 2)
+        self.assertEqual(model.families, [['one', 0, 1], ['impl', 1, 2]])
+        
+        sink = ListSink()
+        model.replay(sink)
+        self.assertEqual(sink.batches, [
+            ("one", 0, [([(1, 'a'), (1, 'b'), (1, 'c')], '==', 1)]),
+            ("impl", 0, [([(1, 'a'), (-1, 'b')], '<=', 0)]),
+        ])
+        
+        model.truncate(1)
+        self.assertEqual(len(model), 1)
+        self.assertEqual(model.families, [['one', 0, 1]])
+        self.assertEqual(list(model.constraints(0, 1)), [([(1, 'a'), (1, 'b'), (1, 'c')], '==', 1)])
+    
+    
+    def test_write_mps(self):
+        path = os.path.join(self.directory, 'test.mps')
+        self.example().write_mps(path)
+        with open(path) as f:
+            lines = [line.split() for line in f]
+        
+        self.assertEqual(lines[:5], [['NAME', 'test'], ['ROWS'], ['N', 'COST'], ['E', 'one_0'], ['L', 'impl_0']])
+        self.assertIn(['x_a', 'impl_0', '1'], lines)
+        self.assertIn(['x_b', 'impl_0', '-1'], lines)
+        self.assertIn(['rhs', 'one_0', '1'], lines)
+        self.assertNotIn(['x_c', 'impl_0', '0'], lines)
+        self.assertEqual(lines[-4:], [['BV', 'bnd', 'x_a'], ['BV', 'bnd', 'x_b'], ['BV', 'bnd', 'x_c'], ['ENDATA']])
+    
+    
+    @unittest.skipIf(shutil.which('cbc') is None, "cbc is not available")
+    def test_cbc(self):
+        model = self.example()
+        solutions = CBCSolver().solve(model, solutions=3)
+        self.assertEqual(sorted(sorted(solution) for solution in solutions), [['b'], ['c']])
+        self.assertEqual(len(model), 2)
+        
+        emit(model, "notb", [([(1, 'b')], '==', 0)], verbose=False)
+        emit(model, "notc", [([(1, 'c')], '==', 0)], verbose=False)
+        self.assertEqual(CBCSolver().solve(model), [])
+
+    
+    @unittest.skipIf(all(shutil.which(name) is None for name in SATSolver.executables), "no SAT solver is available")
+    def test_sat(self):
+        model = self.example()
+        solutions = SATSolver().solve(model, solutions=3)
+        self.assertEqual(sorted(sorted(solution) for solution in solutions), [['b'], ['c']])
+        
+        emit(model, "notb", [([(1, 'b')], '==', 0)], verbose=False)
+        emit(model, "notc", [([(1, 'c')], '==', 0)], verbose=False)
+        self.assertEqual(SATSolver().solve(model), [])
+
+
+    def test_solve_lazily(self):
+        # lazy constraints: not c, and a or b
+        def separate(solution, processes):
+            res = []
+            if 'c' in solution:
+                res.append(("notc", [([(1, 'c')], '==', 0)]))
+            if 'a' not in solution and 'b' not in solution:
+                res.append(("aorb", [([(1, 'a'), (1, 'b')], '>=', 1)]))
+            return res
+        
+        model = self.example()
+        solutions = EnumerationSolver().solve_lazily(model, separate, solutions=2)
+        self.assertEqual(solutions, [set(['b'])])
+        self.assertEqual([name for name, start, end in model.families], ['one', 'impl', 'aorb_1', 'notc_1'])
+        
+        emit(model, "notb", [([(1, 'b')], '==', 0)], verbose=False)
+        self.assertEqual(EnumerationSolver().solve_lazily(model, separate), [])
+
+
+class TestCore(unittest.TestCase):
+    
+    def test_infeasible_subset(self):
+        model = Model('test', ['a', 'b', 'c', 'd'])
+        emit(model, "fix", [([(1, 'a')], '>=', 1), ([(1, 'c'), (1, 'd')], '==', 1)], verbose=False)
+        emit(model, "impl", [([(1, 'a'), (-1, 'b')], '<=', 0), ([(1, 'b')], '<=', 0)], verbose=False)
+        
+        # found by propagation
+        self.assertEqual(infeasible_subset(model, range(len(model)), EnumerationSolver()), [0, 2, 3])
+        self.assertIsNone(infeasible_subset(model, [0, 1, 2], EnumerationSolver()))
+        self.assertEqual(list(subsystem(model, [3, 1]).constraints(0, 2)), [([(1, 'c'), (1, 'd')], '==', 1), ([(1, 'b')], '<=', 0)])
+    
+    
+    def test_minimize(self):
+        # 3 pigeons in 2 holes (not found by propagation), with other constraints
+        pigeons = ['p%d%d' % (i, h) for i in range(3) for h in range(2)]
+        model = Model('test', pigeons + ['a', 'b', 'c'])
+        emit(model, "extra", [([(1, 'a'), (1, 'b')], '==', 1), ([(1, 'p00'), (1, 'a')], '<=', 2)], verbose=False)
+        emit(model, "pigeon", [([(1, 'p%d0' % i), (1, 'p%d1' % i)], '>=', 1) for i in range(3)], verbose=False)
+        emit(model, "hole", [([(1, 'p%d%d' % (i, h)) for i in range(3)], '<=', 1) for h in range(2)], verbose=False)
+        emit(model, "impl", [([(1, 'b'), (-1, 'c')], '<=', 0)], verbose=False)
+        
+        for threads in [1, 3]:
+            core = minimize(model, range(len(model)), EnumerationSolver(), threads=threads)
+            self.assertEqual(core, [2, 3, 4, 5, 6])
+        self.assertEqual(families(model, core), {'pigeon': 3, 'hole': 2})
+        self.assertEqual(EnumerationSolver().solve(subsystem(model, core)), [])
+        self.assertRaises(ValueError, minimize, model, [0, 1, 2, 3, 4, 5], EnumerationSolver())
+        
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, 'core.txt')
+            write_core(path, model, core, lambda var: var.upper())
+            with open(path) as f:
+                lines = f.read().splitlines()
+            self.assertEqual(lines[0], "# 5 constraints, 6 triples")
+            self.assertEqual(lines[1], "pigeon[0]: +1 'P00' +1 'P01' >= 1")
+            self.assertEqual(lines[5], "hole[1]: +1 'P01' +1 'P11' +1 'P21' <= 1")
+            self.assertEqual(lines[7:], ["'P%d%d'" % (i, h) for i in range(3) for h in range(2)])
+        finally:
+            shutil.rmtree(directory)
+
+
+class TestCNF(unittest.TestCase):
+    
+    def test_encode(self):
+        # compare with brute force on every assignment of the variables and the auxiliary variables
+        for terms, sense, rhs in [
+                ([(1,1), (1,2), (-1,3)], '<=', 1),
+                ([(1,1), (1,2), (1,3), (1,4), (1,5), (1,6), (1,7)], '==', 1),
+                ([(1,1), (-1,2), (1,3), (1,4), (1,5)], '<=', 1),
+                ([(1,1), (1,2), (1,3), (1,4), (1,5)], '>=', 3),
+                ([(2,1), (1,2), (-1,3)], '<=', 1),
+                ([(1,1), (1,2)], '<=', -1),
+            ]:
+            variables = [max(x for coef, x in terms)]
+            def new_variable():
+                variables[0] += 1
+                return variables[0]
+            clauses = encode(terms, sense, rhs, new_variable)
+            
+            for values in itertools.product([False, True], repeat=variables[0]):
+                value = lambda x: values[x-1] if x > 0 else not values[-x-1]
+                if not all(any(value(x) for x in clause) for clause in clauses):
+                    continue
+                total = sum(coef * values[x-1] for coef, x in terms)
+                self.assertTrue({'<=': total <= rhs, '>=': total >= rhs, '==': total == rhs}[sense])
+            
+            for values in itertools.product([False, True], repeat=max(x for coef, x in terms)):
+                total = sum(coef * values[x-1] for coef, x in terms)
+                if {'<=': total <= rhs, '>=': total >= rhs, '==': total == rhs}[sense]:
+                    # some assignment of the auxiliary variables satisfies the clauses
+                    self.assertTrue(any(
+                        all(any((values + aux)[abs(x)-1] == (x > 0) for x in clause) for clause in clauses)
+                        for aux in itertools.product([False, True], repeat=variables[0] - len(values))
+                    ))
+    
+    
+    def test_read_assignment(self):
+        self.assertEqual(read_assignment(["c comment\n", "s SATISFIABLE\n", "v 1 -2 3\n", "v -4 5 0\n"]), set([1, 3, 5]))
+        self.assertEqual(read_assignment(["s UNSATISFIABLE\n"]), None)
+
+
+class TestPresolve(unittest.TestCase):
+    
+    def test_rules(self):
+        index = TreeIndex(4)
+        t, r, s = index.encode(((1,2,3,4), (1,(2,(3,4))), (1,(2,(3,4)))))
+        self.assertFalse(unanimity(index, (t,r,s)))
+        self.assertTrue(unanimity(index, (r,r,r)))
+        # (3,4) is a cluster of both r and s, but not of t
+        u = index.ids[(2,(1,(3,4)))]
+        self.assertFalse(pareto_on_triples(index, (t,r,u)))
+        self.assertTrue(pareto_on_triples(index, (r,r,u)))
+        # exchanging 1 and 2 maps the profile (r,u) to (u,r): it fixes (1,2,(3,4)), but not r
+        self.assertTrue(symmetric_profile(index, (index.ids[(1,2,(3,4))], r, u)))
+        self.assertFalse(symmetric_profile(index, (r,r,u)))
+        # exchanging 2 and 3 maps ((1,2),(3,4)) to ((1,3),(2,4)), and (1,2,(3,4)) to (1,3,(2,4))
+        a, b = index.ids[((1,2),(3,4))], index.ids[((1,3),(2,4))]
+        self.assertFalse(symmetric_profile(index, index.normalize((index.ids[(1,2,(3,4))], a, b))))
+        self.assertTrue(symmetric_profile(index, index.normalize((index.ids[(1,2,3,4)], a, b))))
+        
+        rules = [unanimity, symmetric_profile]
+        v = index.ids[(1,2,(3,4))]
+        triples = [(t,r,s), (r,r,u), (v,r,u)]
+        log = []
+        violated = [first_violated_rule(index, triple, rules) for triple in triples]
+        self.assertEqual(violated, [0, 1, -1])
+        self.assertEqual(filter_triples(triples, violated, rules, log), [(v,r,u)])
+        self.assertEqual(log, [((t,r,s), 0, 'unanimity'), ((r,r,u), 0, 'symmetric_profile')])
+    
+    
+    def test_presolve(self):
+        model = Model('test', ['a', 'b', 'c', 'd', 'e'])
+        emit(model, "forced", [([(1, 'a')], '==', 1)], verbose=False)
+        emit(model, "excl", [([(1, 'a'), (1, 'b')], '<=', 1), ([(1, 'c'), (1, 'e')], '<=', 1)], verbose=False)
+        emit(model, "one", [([(1, 'b'), (1, 'c'), (1, 'd')], '==', 1)], verbose=False)
+        
+        log = []
+        reduced, fixed = presolve(model, log)
+        self.assertEqual(fixed, {'a': 1, 'b': 0})
+        self.assertEqual(log, [('a', 1, 'forced[0]'), ('b', 0, 'excl[0]')])
+        self.assertEqual(summary(log), {'forced': 1, 'excl': 1})
+        
+        self.assertEqual(reduced.variables, ['c', 'd', 'e'])
+        self.assertEqual(list(reduced.constraints(0, len(reduced))), [
+            ([(1, 'c'), (1, 'e')], '<=', 1),
+            ([(1, 'c'), (1, 'd')], '==', 1),
+        ])
+        
+        emit(model, "contradiction", [([(1, 'b'), (1, 'e')], '>=', 2)], verbose=False)
+        log = []
+        self.assertEqual(presolve(model, log), (None, None))
+        self.assertEqual(log[-1][:2], (None, None))
+
+
+def squares_shard(state, start, end):
+    res = array('i')
+    for x in state[start:end]:
+        res.extend((x, x*x))
+    return res
+
+
+class TestParallel(unittest.TestCase):
+    
+    def test_shard_bounds(self):
+        self.assertEqual(shard_bounds(10, 3), [(0,3), (3,6), (6,10)])
+        self.assertEqual(shard_bounds(2, 5), [(0,1), (1,2)])
+        self.assertEqual(shard_bounds(0, 5), [(0,0)])
+    
+    
+    def test_map_shards(self):
+        state = list(range(1000))
+        expected = [(x, x*x) for x in range(1000)]
+        for processes in [1, 3]:
+            self.assertEqual(list(rows(map_shards(squares_shard, state, len(state), processes=processes), 2)), expected)
+        
+        # the workers are forked even if the default start method is different
+        method = multiprocessing.get_start_method(allow_none=True)
+        multiprocessing.set_start_method('forkserver', force=True)
+        try:
+            self.assertEqual(list(rows(map_shards(squares_shard, state, len(state), processes=2), 2)), expected)
+        finally:
+            multiprocessing.set_start_method(method, force=True)
+    
+    
+    def test_variable_rows(self):
+        arrays = [array('i', [2, 5, 6, 0, 3, 1, 2, 3]), array('i'), array('i', [1, 4])]
+        self.assertEqual(list(variable_rows(arrays)), [(5, 6), (), (1, 2, 3), (4,)])
+
+
+class TestExtension(unittest.TestCase):
+    
+    def test_cliques(self):
+        n = 4
+        index = TreeIndex(n)
+        triples = []
+        for k in range(3, n+1):
+            triples += [index.encode(triple) for triple in find_normal_forms(range(1, k+1))[2]]
+        triples = [(t,r,s) for (t,r,s) in triples if index.binary[r] and index.binary[s]]
+        state = {
+            'index': index,
+            'possible_triples': triples,
+            'variables': {triple: i for i, triple in enumerate(triples)},
+            'refinement_matrices': {k: refinement_matrix(sorted(all_trees(range(1, k+1)), key=tree_key)) for k in range(3, n)},
+        }
+        
+        state['pairwise'] = True
+        pairs = list(variable_rows([extension_stability_shard(state, 0, len(triples))]))
+        self.assertEqual(len(pairs), len(set(pairs)))
+        
+        state['pairwise'] = False
+        cliques = list(variable_rows([extension_stability_shard(state, 0, len(triples))]))
+        self.assertLess(len(cliques), len(pairs))
+        self.assertEqual(set((clique[0], second) for clique in cliques for second in clique[1:]), set(pairs))
+        for clique in cliques:
+            # the second triples are consensus triples of the same pair up to symmetry
+            self.assertEqual(len(set(frozenset([index.normalize((r,s)), index.normalize((s,r))]) for (t,r,s) in (triples[i] for i in clique[1:]))), 1)
+
+
+def star_consensus(n):
+    """
+    Normal triples of the consensus method which gives r for the pair (r,r) and the star tree
+    otherwise, on profiles of binary trees with 3, ..., n leaves.
+    """
+    triples = []
+    for k in range(3, n+1):
+        star = tuple(range(1, k+1))
+        for (r,s) in find_normal_forms(range(1, k+1))[1]:
+            if is_binary(r) and is_binary(s):
+                triples.append((r if r == s else star, r, s))
+    return triples
+
+
+class TestCertificate(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    
+    def test_read_write(self):
+        path = os.path.join(self.directory, 'certificate.json')
+        triples = star_consensus(4)
+        write_certificate(path, 'extension', 4, triples)
+        program, n, decoded = read_certificate(path)
+        self.assertEqual((program, n, sorted(decoded, key=tree_key)), ('extension', 4, sorted(triples, key=tree_key)))
+        
+        write_certificate(path, 'associative', 5, None)
+        self.assertEqual(read_certificate(path), ('associative', 5, None))
+    
+    
+    def test_expand(self):
+        consensus, conflicts = expand([((1,2,3), (1,(2,3)), (2,(1,3)))], [1,2,3,4])
+        self.assertEqual(conflicts, [])
+        # 4 subsets, 6 ordered pairs of different binary trees on each
+        self.assertEqual(len(consensus), 24)
+        self.assertEqual(consensus[(2,(3,4)), (4,(2,3))], (2,3,4))
+        
+        consensus, conflicts = expand([((1,(2,3)), (1,(2,3)), (2,(1,3)))], [1,2,3])
+        self.assertGreater(len(conflicts), 0)
+    
+    
+    def test_verify(self):
+        results = verify('extension', 3, star_consensus(3))
+        self.assertEqual([count for count, first in results.values()], [0, 0, 0, 0])
+        
+        # the star tree is not extension stable on 4 leaves: e.g. both profiles of
+        # (1,(2,(3,4))) and (2,(1,(3,4))) restricted to {1,3,4} are unanimous
+        results = verify('extension', 4, star_consensus(4))
+        self.assertEqual(results['conflicts'][0], 0)
+        self.assertGreater(results['extension_stability'][0], 0)
+        
+        # a triple excluded by symmetric_profile: (2 3) exchanges r and s, but not t
+        results = verify('extension', 4, [((1,3,(2,4)), ((1,3),(2,4)), ((1,2),(3,4)))])
+        self.assertGreater(results['conflicts'][0], 0)
+        
+        # the strict consensus on 3 leaves: associative and Pareto on rooted triples
+        triples = [(r if r == s else (1,2,3), r, s) for (r,s) in find_normal_forms(range(1, 4))[1]]
+        results = verify('associative', 3, triples)
+        self.assertEqual(list(results), ['conflicts', 'defined', 'unanimity', 'commutativity', 'associativity', 'pareto_on_triples'])
+        self.assertEqual([count for count, first in results.values()], [0, 0, 0, 0, 0, 0])
+        
+        results = verify('associative', 3, triples[1:])
+        self.assertGreater(results['defined'][0], 0)
+        self.assertNotIn('associativity', results)
+
+
+class TestBenchmark(unittest.TestCase):
+    
+    def test_run_benchmark(self):
+        result = run_benchmark('all_trees', 3)
+        self.assertEqual(result['count'], 4)
+        self.assertIn('NORMAL_TUPLES', result['cache_sizes'])
+    
+    
+    def test_compare_results(self):
+        old = {'results': [{'benchmark': 'compare', 'n': 4, 'seconds': 1.0, 'peak_rss_kb': 10000}]}
+        new = {'results': [{'benchmark': 'compare', 'n': 4, 'seconds': 1.5, 'peak_rss_kb': 10500}]}
+        self.assertEqual(compare_results(old, new, 0.2), [('compare', 4, 'seconds', 1.0, 1.5)])
+        self.assertEqual(compare_results(old, new, 0.6), [])
+        self.assertEqual(compare_results(new, old, 0.2), [])
+
+
+
+class TestInstrumentation(unittest.TestCase):
+    
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+    
+    
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+    
+    
+    def test_trace(self):
+        path = os.path.join(self.directory, 'trace.json')
+        instrumentation.start(path)
+        try:
+            instrumentation.phase("first")
+            instrumentation.count(trees=10)
+            self.assertEqual(emit(ListSink(), "family", [([(1, 'a')], '<=', 1)] * 5, batch_size=2, verbose=False), 5)
+            instrumentation.phase("second")
+            self.assertIsNone(instrumentation.eta())
+            self.assertEqual(len(list(map_shards(squares_shard, list(range(100)), 100))), 16)
+            self.assertEqual(instrumentation.eta(), 0)
+        finally:
+            instrumentation.stop()
+        self.assertFalse(instrumentation.enabled())
+        
+        with open(path) as f:
+            events = json.load(f)['traceEvents']
+        spans = {event['name']: event for event in events if event['ph'] == 'X'}
+        self.assertEqual(sorted(spans), ['family', 'first', 'second'])
+        self.assertEqual(spans['first']['args']['trees'], 10)
+        self.assertEqual(spans['first']['args']['family'], 5)
+        self.assertEqual(spans['family']['args'], {'constraints': 5})
+        self.assertIn('memory', [event['name'] for event in events if event['ph'] == 'C'])
+
+
+# MD5 digests of results recorded with the Python 2 version: the data of the cache files
+# (as decimal integers separated by spaces), and the LP files written by the programs
+RECORDED_CACHE = {
+    (3, 'trees'): 'ee5a46a792973f85aaa1841a402d0494',
+    (3, 'normal_trees'): '27a3f1a3d555387ab7bf589ca716c295',
+    (3, 'normal_pairs'): 'f4651ca676e96ac5da1152656850a8e0',
+    (3, 'normal_triples'): '85bd41083e10c8bf631bd44be13f37f5',
+    (3, 'refinement'): '79fc23419ad8084eda53fc72d419ed13',
+    (3, 'restrictions'): 'ae7cf7b2818e392c8058fa326e02e172',
+    (4, 'trees'): '32059788080e1517eb12f39c6359db96',
+    (4, 'normal_trees'): '10d6fde39a17f0a5552f335cdfb05650',
+    (4, 'normal_pairs'): '80c2baa8842986cc087db329544f2a56',
+    (4, 'normal_triples'): 'ba88a49da3b5189e3094229cfeb68608',
+    (4, 'refinement'): '3d3de0e607e7e1ac308769caef940c55',
+    (4, 'restrictions'): 'd09b3439062e58500a256e7f991aa74c',
+}
+
+PYTHON2_MODELS = {
+    ('associative.py', 3): '27e3dc276daa7ef22bfc06c236a42fb9',
+    ('associative.py', 4): 'dadfa9d4ed966ad16bf739056e3d0bb3',
+    ('extension.py', 3): 'ba741b8a7f6c7f9fcc506c521bbb8c71',
+    ('extension.py', 4): 'e024d01dc13371456fc0032e1e887d2d',
+}
+
+# MD5 digests of the LP files written by the current version: the models of associative.py
+# are the ones of the Python 2 version, while the models of extension.py have fewer triples
+# since the rule symmetric_profile was added (recorded with Python 3 when it was added)
+RECORDED_MODELS = dict(PYTHON2_MODELS)
+RECORDED_MODELS.update({
+    ('extension.py', 3): '08381945c71f085822c3652dc12a51cf',
+    ('extension.py', 4): '5474634f2c587e985410f3ae653f4138',
+})
+
+
+class TestRecorded(unittest.TestCase):
+    
+    def setUp(self):
+        self.cache_dir = cache.CACHE_DIR
+        cache.CACHE_DIR = tempfile.mkdtemp()
+    
+    
+    def tearDown(self):
+        shutil.rmtree(cache.CACHE_DIR)
+        cache.CACHE_DIR = self.cache_dir
+    
+    
+    def test_cache(self):
+        for n in [3, 4]:
+            cache.cached_normal_forms(n)
+            cache.cached_refinement_matrix(n)
+            TreeIndex(n, cached=True).load_restriction_index()
+        for (n, kind), digest in sorted(RECORDED_CACHE.items()):
+            data = ' '.join(str(x) for x in cache.read_array(n, kind))
+            self.assertEqual(hashlib.md5(data.encode('ascii')).hexdigest(), digest, (n, kind))
+    
+    
+    def test_models(self):
+        path = os.path.join(cache.CACHE_DIR, 'model.lp')
+        directory = os.path.dirname(os.path.abspath(__file__))
+        # the programs compute everything again, in the empty cache directory of the test
+        environment = dict(os.environ, CONSENSUS_CACHE_DIR=cache.CACHE_DIR)
+        for (script, n), digest in sorted(RECORDED_MODELS.items()):
+            with open(os.devnull, 'w') as devnull:
+                subprocess.check_call([sys.executable, os.path.join(directory, script), str(n), '--lp', path], stdout=devnull, env=environment)
+            with open(path, 'rb') as f:
+                self.assertEqual(hashlib.md5(f.read()).hexdigest(), digest, (script, n))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -4,87 +4,330 @@ A phylogenetic tree on leaf set X is represented as a sorted tuple of:
 - (recursively) tuples representing phylogenetic trees.
 For example, the three rooted triples (phylogenetic binary trees on 3 leaves)
 on X = {1,2,3} are: (1,(2,3)), (2,(1,3)), (3,(1,2)).
+Trees are sorted by tree_key, where leaves come before subtrees.
+
+Internally, a tree is also described by the set of its clusters, each encoded
+as an integer bitmask where leaf x corresponds to the bit 1 << x.
+For example, the clusters of (1,(2,3)) are 0b10, 0b100, 0b1000, 0b1100, 0b1110.
+
+The results of the most used functions are cached in memos (see memo.py), whose
+number of entries can be limited.
 """
 
+import os
+import gc
 import sys
+import bisect
+import operator
+import shutil
+import tempfile
 import itertools
+from array import array
 from multiprocessing import Pool
 
+from memo import Memo
+import instrumentation
+
+
+def tree_key(t):
+    """
+    Key of the order of trees (and of tuples of trees), which is used to sort them: trees are
+    compared as tuples, where leaves are smaller than subtrees.
+    """
+    if isinstance(t, tuple):
+        return (1, tuple(tree_key(s) for s in t))
+    return (0, t)
+
 
 def powerset(X):
     "Generate all subsets of X."
     return itertools.chain.from_iterable(itertools.combinations(X, r) for r in range(len(X)+1))
 
 
+def restricted_growth_strings(n):
+    """
+    Generate the restricted growth strings of length n in lexicographic order, i.e. the lists a
+    with a[0] = 0 and a[i] <= 1 + max(a[:i]), which encode the set partitions of n elements
+    (element i is in block a[i]).
+    The same list is updated in place and yielded every time.
+    """
+    if n == 0:
+        yield []
+        return
+    
+    a = [0] * n
+    # b[i] = 1 + max(a[:i]) is the largest value of a[i]
+    b = [0] + [1] * (n-1)
+    yield a
+    while True:
+        i = n-1
+        while i > 0 and a[i] == b[i]:
+            i -= 1
+        if i == 0:
+            return
+        a[i] += 1
+        for j in range(i+1, n):
+            a[j] = 0
+            b[j] = max(b[j-1], a[j-1] + 1)
+        yield a
+
+
 def set_partitions(X):
     """
     Generate all set partitions of X.
     """
     X = list(X)
-    if len(X) == 1:
-        yield [X]
-        return
+    for a in restricted_growth_strings(len(X)):
+        blocks = [[] for j in range(max(a) + 1)] if len(X) > 0 else []
+        for x, j in zip(X, a):
+            blocks[j].append(x)
+        yield blocks
+
+
+def enumerate_trees(X, clusters=False, binary=False):
+    """
+    Find all phylogenetic trees on leaf set X (only the binary ones if binary is True), as a
+    list of pairs (key, tree) sorted by key, or of triples (key, tree, clusters) if clusters
+    is True, where clusters is the tuple of the cluster bitmasks of the tree.
+    The keys are strings of bytes which are in the same order as the trees (see tree_key),
+    but are compared much faster: a leaf is encoded as 1 followed by its position in the
+    sorted leaf set, and a tree as 2 followed by its subtrees and by 0.
+    The trees on every subset of X are built once, and memoized by the bitmask of the subset
+    (where bit i stands for X[i]): the trees on a subset are the combinations of the trees on
+    the blocks of its nontrivial set partitions (of its partitions into two blocks, for binary
+    trees).
+    """
+    X = sorted(X, key=tree_key)
+    table = {}
+    for i, x in enumerate(X):
+        table[1 << i] = [(bytes((1, i)), x, (1 << x,)) if clusters else (bytes((1, i)), x)]
+    
+    # the entries have no reference cycles, so the cyclic garbage collector (which would
+    # scan all of them many times) is paused
+    enabled = gc.isenabled()
+    gc.disable()
+    try:
+        _combine_subsets(X, table, clusters, binary)
+    finally:
+        if enabled:
+            gc.enable()
     
-    x = X[0]
-    for Y in powerset(X[1:]):
-        Y_set = set(Y)
-        Z = [z for z in X[1:] if z not in Y_set]
+    entries = table[(1 << len(X)) - 1] if len(X) > 0 else []
+    entries.sort()
+    return entries
+
+
+def _combine_subsets(X, table, clusters, binary):
+    """
+    Fill the table of enumerate_trees with the entries of the trees on all subsets of X with at
+    least two leaves.
+    """
+    # subsets come before their supersets
+    for mask in range(1, 1 << len(X)):
+        if mask & (mask-1) == 0:
+            # single leaf
+            continue
         
-        if len(Z) == 0:
-            yield [X]
+        cluster = leaves_to_mask(X[i] for i in set_bits(mask)) if clusters else None
+        entries = []
+        for blocks in (_splits(mask) if binary else _partitions(mask)):
+            # the entries of the subtrees are sorted by their keys, which are all different
+            if clusters:
+                for children in itertools.product(*[table[block] for block in blocks]):
+                    keys, subtrees, subclusters = zip(*sorted(children))
+                    entries.append((b'\x02' + b''.join(keys) + b'\x00', subtrees, sum(subclusters, (cluster,))))
+            else:
+                for children in itertools.product(*[table[block] for block in blocks]):
+                    keys, subtrees = zip(*sorted(children))
+                    entries.append((b'\x02' + b''.join(keys) + b'\x00', subtrees))
         
-        else:
-            for p in set_partitions(Z):
-                yield [[x] + list(Y)] + p
+        table[mask] = entries
 
 
-def all_trees(X):
+def _partitions(mask):
     """
-    Generate all phylogenetic trees on leaf set X.
+    Generate the nontrivial set partitions of the bits of mask, as lists of bitmasks.
     """
-    if len(X) == 1:
-        yield X[0]
+    positions = set_bits(mask)
+    for a in restricted_growth_strings(len(positions)):
+        size = max(a) + 1
+        if size == 1:
+            # trivial partition
+            continue
+        
+        blocks = [0] * size
+        for i, j in zip(positions, a):
+            blocks[j] |= 1 << i
+        yield blocks
+
+
+def _splits(mask):
+    """
+    Generate the partitions of the bits of mask into two blocks, as lists of bitmasks
+    (the first block contains the lowest bit).
+    """
+    low = mask & -mask
+    rest = mask ^ low
+    # submasks of rest, in decreasing order
+    sub = rest
+    while True:
+        block = low | sub
+        if block != mask:
+            yield [block, mask ^ block]
+        if sub == 0:
+            return
+        sub = (sub-1) & rest
+
+
+def all_trees(X, encoding='tree', binary=False):
+    """
+    Generate all phylogenetic trees on leaf set X, sorted by tree_key (see enumerate_trees).
+    If binary is True, only the binary trees are generated (the other ones are not built).
+    With encoding='id', generate the IDs of the trees instead (their positions among all the
+    trees, see tree_ids); with encoding='masks', generate the sorted arrays of the cluster
+    bitmasks of the trees.
+    """
+    entries = enumerate_trees(X, clusters=(encoding == 'masks'), binary=binary)
+    if encoding == 'tree':
+        for entry in entries:
+            yield entry[1]
+    
+    elif encoding == 'id':
+        if binary:
+            ids = tree_ids(X)
+            for entry in entries:
+                yield ids[entry[1]]
+        else:
+            for i in range(len(entries)):
+                yield i
+    
+    elif encoding == 'masks':
+        for entry in entries:
+            yield array('q', sorted(entry[2]))
     
     else:
-        for p in set_partitions(X):
-            if len(p) == 1:
-                # trivial partition
-                continue
-            
-            for subtrees in itertools.product(*[all_trees(Y) for Y in p]):
-                yield tuple(sorted(subtrees))
+        raise ValueError("Unknown encoding %r" % encoding)
 
 
-def leaf_set(t):
+def leaves_to_mask(Y):
     """
-    Find leaf set of a phylogenetic tree (as a list).
+    Encode a set of leaves as an integer bitmask (leaf x corresponds to the bit 1 << x).
+    """
+    mask = 0
+    for y in Y:
+        mask |= 1 << y
+    return mask
+
+
+def mask_to_leaves(mask):
+    """
+    Decode an integer bitmask into the sorted list of its leaves.
+    """
+    return set_bits(mask)
+
+
+def set_bits(mask):
+    """
+    Find the positions of the bits of mask which are set (as a sorted list).
     """
-    if not isinstance(t, tuple):
-        # t is a leaf
-        return [t]
-    
     res = []
-    for s in t:
-        res += leaf_set(s)
-    return sorted(res)
+    while mask:
+        low = mask & -mask
+        res.append(low.bit_length() - 1)
+        mask ^= low
+    return res
 
 
-CLUSTERS = {}
-def clusters(t):
+def popcount(mask):
+    "Number of leaves in a bitmask."
+    return bin(mask).count("1")
+
+
+CLUSTER_MASKS = Memo('CLUSTER_MASKS')
+def cluster_masks(t):
     """
-    Find the clusters of a phylogenetic tree (as a list of tuples).
+    Find the clusters of a phylogenetic tree (as a frozenset of bitmasks).
+    The leaves of t must be non-negative integers.
     """
-    if t not in CLUSTERS:
+    if t not in CLUSTER_MASKS:
         if not isinstance(t, tuple):
             # t is a leaf
-            CLUSTERS[t] = [(t,)]
+            CLUSTER_MASKS[t] = frozenset([1 << t])
         
         else:
-            res = []
+            res = set()
+            root = 0
             for s in t:
-                res += clusters(s)
-            res.append(tuple(leaf_set(t)))
-            CLUSTERS[t] = res
+                c = cluster_masks(s)
+                res |= c
+                root |= max(c)
+            res.add(root)
+            CLUSTER_MASKS[t] = frozenset(res)
+    
+    return CLUSTER_MASKS[t]
+
+
+def leaf_mask(t):
+    """
+    Find leaf set of a phylogenetic tree (as a bitmask).
+    """
+    # the root cluster is a superset of all other clusters, hence the largest one
+    return max(cluster_masks(t))
+
+
+ZERO_MASK = frozenset([0])
+
+MASK_TREES = Memo('MASK_TREES')
+def masks_to_tree(masks):
+    """
+    Build the phylogenetic tree whose clusters are the given bitmasks.
+    The masks must form a hierarchy containing all singletons below the root.
+    Return None if there are no clusters.
+    """
+    masks = frozenset(masks)
+    if masks not in MASK_TREES:
+        MASK_TREES[masks] = _build_tree(masks)
+    
+    return MASK_TREES[masks]
+
+
+def _build_tree(masks):
+    "Build the tree of a hierarchy of bitmasks (without caching)."
+    if len(masks) == 0:
+        return None
+    
+    # the parent of a cluster is its smallest strict superset
+    by_size = sorted(masks, key=popcount)
+    children = {c: [] for c in by_size}
+    for i, c in enumerate(by_size):
+        for d in by_size[i+1:]:
+            if c & d == c and c != d:
+                children[d].append(c)
+                break
+    
+    def build(c):
+        if len(children[c]) == 0:
+            # c is a leaf
+            return c.bit_length() - 1
+        return tuple(sorted((build(d) for d in children[c]), key=tree_key))
+    
+    return build(by_size[-1])
+
+
+def leaf_set(t):
+    """
+    Find leaf set of a phylogenetic tree (as a list).
+    """
+    return mask_to_leaves(leaf_mask(t))
+
+
+CLUSTERS = Memo('CLUSTERS')
+def clusters(t):
+    """
+    Find the clusters of a phylogenetic tree (as a list of tuples).
+    """
+    if t not in CLUSTERS:
+        CLUSTERS[t] = [tuple(mask_to_leaves(c)) for c in sorted(cluster_masks(t))]
     
     return CLUSTERS[t]
 
@@ -93,8 +336,7 @@ def compare(t, s):
     """
     Check if t <= s, in the sense that all the clusters of t are also clusters of s.
     """
-    c = set(clusters(s))
-    return all(cluster in c for cluster in clusters(t))
+    return cluster_masks(t) <= cluster_masks(s)
 
 
 def restriction(t, Y):
@@ -102,19 +344,40 @@ def restriction(t, Y):
     Restriction of the tree t to the leaf set Y.
     Return None if Y is disjoint from the leaf set of t.
     """
-    if not isinstance(t, tuple):
-        # t is a leaf
-        return t if t in Y else None
+    return mask_restriction(t, leaves_to_mask(Y))
+
+
+def mask_restriction(t, mask):
+    """
+    Restriction of the tree t to the leaf set given by a bitmask.
+    Return None if the leaf sets are disjoint.
+    """
+    return masks_to_tree(frozenset([c & mask for c in cluster_masks(t)]) - ZERO_MASK)
+
+
+def refinement_matrix(trees):
+    """
+    Find the matrix R such that R[i,j] = 1 if trees[i] refines trees[j], i.e. compare(trees[j], trees[i]).
+    Rows are packed as integer bitsets: R[i,j] = R[i] >> j & 1.
+    """
+    # bitsets of the trees containing each cluster
+    containing = {}
+    for j, s in enumerate(trees):
+        for c in cluster_masks(s):
+            containing[c] = containing.get(c, 0) | (1 << j)
     
-    subtrees = [restriction(s, Y) for s in t]
-    subtrees = [s for s in subtrees if s is not None]
+    full = (1 << len(trees)) - 1
+    rows = []
+    for t in trees:
+        # trees[i] refines trees[j] if and only if trees[j] has no cluster outside trees[i]
+        clusters_t = cluster_masks(t)
+        outside = 0
+        for c, bits in containing.items():
+            if c not in clusters_t:
+                outside |= bits
+        rows.append(full & ~outside)
     
-    if len(subtrees) == 0:
-        return None
-    elif len(subtrees) == 1:
-        return subtrees[0]
-    else:
-        return tuple(sorted(subtrees))
+    return rows
 
 
 def is_binary(t):
@@ -135,21 +398,160 @@ def all_permutations(X):
     """
     X = list(X)
     for permutation in itertools.permutations(X):
-        yield {X[i]: permutation[i] for i in xrange(len(X))}
+        yield {X[i]: permutation[i] for i in range(len(X))}
 
 
 def apply_permutation(t, sigma):
     """
     Apply the permutation sigma on the leaves of t.
     """
+    return _apply_permutation(t, sigma)[1]
+
+
+def _apply_permutation(t, sigma):
+    """
+    Apply the permutation sigma on the leaves of t, and return the key of the result (see tree_key)
+    together with it. The keys of the children are used to sort them.
+    """
     if not isinstance(t, tuple):
         # t is a leaf
-        return sigma[t]
+        x = sigma[t]
+        return (0, x), x
     
-    return tuple(sorted(apply_permutation(s, sigma) for s in t))
+    children = []
+    for s in t:
+        if isinstance(s, tuple):
+            children.append(_apply_permutation(s, sigma))
+        else:
+            x = sigma[s]
+            children.append(((0, x), x))
+    children.sort(key=operator.itemgetter(0))
+    return (1, tuple([key for key, s in children])), tuple([s for key, s in children])
 
 
-NORMAL_TREES = {}
+def shift(t, offset):
+    """
+    Add offset to all the leaves of t.
+    """
+    if not isinstance(t, tuple):
+        # t is a leaf
+        return t + offset
+    
+    return tuple(shift(s, offset) for s in t)
+
+
+CANONICAL_LABELLINGS = Memo('CANONICAL_LABELLINGS')
+def canonical_labelling(t):
+    """
+    Find the smallest tree in the orbit of t, on leaf set [1, ..., n].
+    Return the smallest tree and the leaves of t in the order in which they are mapped to 1, ..., n.
+    The leaves of the smallest tree are increasing in a depth-first visit, so it is obtained by
+    sorting the canonical forms of the children of the root (leaves first) and relabelling them
+    with consecutive blocks of labels.
+    """
+    if t not in CANONICAL_LABELLINGS:
+        if not isinstance(t, tuple):
+            # t is a leaf
+            CANONICAL_LABELLINGS[t] = (1, [t])
+        
+        else:
+            form = []
+            order = []
+            for child_form, child_order in sorted((canonical_labelling(s) for s in t), key=tree_key):
+                form.append(shift(child_form, len(order)))
+                order += child_order
+            CANONICAL_LABELLINGS[t] = (tuple(form), order)
+    
+    return CANONICAL_LABELLINGS[t]
+
+
+LEAF_PARENTS = Memo('LEAF_PARENTS')
+def leaf_parents(t):
+    """
+    Map every leaf of t to the cluster (as a bitmask) of its parent.
+    """
+    if t not in LEAF_PARENTS:
+        res = {}
+        if not isinstance(t, tuple):
+            # t is a leaf
+            res[t] = 0
+        
+        else:
+            for s in t:
+                if isinstance(s, tuple):
+                    res.update(leaf_parents(s))
+                else:
+                    res[s] = leaf_mask(t)
+        
+        LEAF_PARENTS[t] = res
+    
+    return LEAF_PARENTS[t]
+
+
+def twin_classes(tup):
+    """
+    Partition the leaves of a tuple of trees into classes of twins, i.e. leaves with the same
+    parent in every tree. Every permutation of a class of twins is an automorphism of the tuple.
+    Return a list of sorted classes.
+    """
+    parents = [leaf_parents(t) for t in tup]
+    classes = {}
+    for x in sorted(parents[0]):
+        classes.setdefault(tuple([p[x] for p in parents]), []).append(x)
+    return sorted(classes.values())
+
+
+CANONICAL_ISOMORPHISMS = Memo('CANONICAL_ISOMORPHISMS')
+def canonical_isomorphisms(t):
+    """
+    Find all the permutations which map t to its smallest form on leaf set [1, ..., n].
+    A permutation sigma is given as a tuple, such that sigma[x] is the image of the leaf x.
+    """
+    if t not in CANONICAL_ISOMORPHISMS:
+        n = max(leaf_set(t))
+        res = []
+        for sigma in _canonical_isomorphisms(t, 0):
+            res.append(tuple(sigma.get(x, 0) for x in range(n+1)))
+        CANONICAL_ISOMORPHISMS[t] = res
+    
+    return CANONICAL_ISOMORPHISMS[t]
+
+
+def _canonical_isomorphisms(t, offset):
+    """
+    Generate all the permutations (as dictionaries) which map t to its smallest form shifted by offset.
+    Children of a node with the same canonical form can be exchanged.
+    """
+    if not isinstance(t, tuple):
+        # t is a leaf
+        yield {t: offset+1}
+        return
+    
+    groups = []
+    for form, child in sorted(((canonical_labelling(s)[0], s) for s in t), key=tree_key):
+        if len(groups) > 0 and groups[-1][0] == form:
+            groups[-1][1].append(child)
+        else:
+            groups.append((form, [child]))
+    
+    choices = []
+    for form, children in groups:
+        size = len(canonical_labelling(children[0])[1])
+        choices.append([])
+        for arrangement in itertools.permutations(children):
+            blocks = [list(_canonical_isomorphisms(child, offset + i*size)) for i, child in enumerate(arrangement)]
+            choices[-1].extend(itertools.product(*blocks))
+        offset += size * len(children)
+    
+    for assignments in itertools.product(*choices):
+        sigma = {}
+        for block in assignments:
+            for assignment in block:
+                sigma.update(assignment)
+        yield sigma
+
+
+NORMAL_TREES = Memo('NORMAL_TREES')
 def normalize_tree(t):
     """
     Find normal form of the given tree w.r.t. the symmetric group action.
@@ -157,90 +559,214 @@ def normalize_tree(t):
     """
     if t not in NORMAL_TREES:
         # compute normal form
-        X = leaf_set(t)
-        normal_form = t
-        
-        for sigma in all_permutations(X):
-            normal_form = min(normal_form, apply_permutation(t, sigma))
-        
-        for sigma in all_permutations(X):
-            NORMAL_TREES[apply_permutation(t, sigma)] = normal_form
+        form, order = canonical_labelling(t)
+        X = sorted(order)
+        NORMAL_TREES[t] = apply_permutation(form, {i+1: X[i] for i in range(len(X))})
     
     return NORMAL_TREES[t]
 
 
-NORMAL_TUPLES = {}
+NORMAL_TUPLES = Memo('NORMAL_TUPLES')
 def normalize_tuple(tup):
     """
     Find normal form of the given tuple of trees w.r.t. the diagonal symmetric group action.
     For triples, we also allow exchanging the second and the third argument.
     The leaf set is changed to [1, ..., n]
+    The normal form is the smallest element of the orbit.
     """
     X = leaf_set(tup[0])
-    Y = range(1, len(X)+1)
+    Y = list(range(1, len(X)+1))
     if X != Y:
         # normalize range
-        sigma = {X[i]: Y[i] for i in xrange(len(X))}
+        sigma = {X[i]: Y[i] for i in range(len(X))}
         tup = tuple(apply_permutation(t, sigma) for t in tup)
         X = Y
     
     if tup not in NORMAL_TUPLES:
         # compute normal form
-        normal_form = tup
-        orbit = [tuple(apply_permutation(t, sigma) for t in tup) for sigma in all_permutations(X)]
+        # the first tree is mapped to its smallest form, and the other trees are relabelled
+        # by the corresponding permutations, up to permutations of twins
+        form = canonical_labelling(tup[0])[0]
+        isomorphisms = canonical_isomorphisms(tup[0])
+        if len(isomorphisms) > 1:
+            twins = [cls for cls in twin_classes(tup) if len(cls) > 1]
+            isomorphisms = [sigma for sigma in isomorphisms if all(sigma[cls[i]] < sigma[cls[i+1]] for cls in twins for i in range(len(cls)-1))]
         
-        if len(tup) == 3:
-            orbit += [(a,c,b) for (a,b,c) in orbit]
+        candidates = [[_apply_permutation(t, sigma) for t in tup[1:]] for sigma in isomorphisms]
         
-        normal_form = min(orbit)
+        if len(tup) == 3:
+            candidates += [[b, a] for a, b in candidates]
         
-        for tup2 in orbit:
-            NORMAL_TUPLES[tup2] = normal_form
+        # all the candidates begin with form, so they are compared by the keys of the other trees
+        smallest = min(candidates, key=lambda candidate: [key for key, t in candidate])
+        NORMAL_TUPLES[tup] = (form,) + tuple(t for key, t in smallest)
     
     return NORMAL_TUPLES[tup]
 
 
-def find_normal_tuples(t):
+def automorphisms(t):
+    """
+    Find the automorphism group of a normal tree t on leaf set [1, ..., n].
+    A permutation sigma is given as a tuple, such that sigma[x] is the image of the leaf x.
+    """
+    # a normal tree is its own smallest form
+    return canonical_isomorphisms(t)
+
+
+def orbit_minima(t, trees):
+    """
+    Map every tree to the smallest element of its orbit under the automorphism group of the normal tree t.
+    """
+    # the normal form of (t,s) is obtained by applying the automorphism of t that minimizes s
+    return {s: normalize_tuple((t,s))[1] for s in trees}
+
+
+def generate_normal_pairs(t, binary=False):
+    """
+    Generate the normal forms of all pairs that begin with the normal tree t, each exactly once
+    (only pairs of binary trees if binary is True).
+    The normal form of (t,r) is (t,r') where r' is the smallest tree in the orbit of r
+    under the automorphism group of t.
+    """
+    if binary and not is_binary(t):
+        return
+    
+    trees = list(all_trees(leaf_set(t), binary=binary))
+    minima = orbit_minima(t, trees)
+    
+    for r in trees:
+        if minima[r] == r:
+            yield (t,r)
+
+
+def generate_normal_triples(t, binary=False):
     """
-    Find normal forms for all pairs and triples that begin with t.
+    Generate the normal forms of all triples that begin with the normal tree t, each exactly once
+    (only triples (t,r,s) where r and s are binary if binary is True).
+    The second tree r ranges over the orbit representatives of the automorphism group G of t,
+    and the third tree s ranges over the representatives of the stabilizer of r in G.
+    Exchanging r and s must not give a smaller triple either.
     """
-    normal_pairs = set()
-    normal_triples = set()
+    G = automorphisms(t)
+    trees = list(all_trees(leaf_set(t), binary=binary))
+    minima = orbit_minima(t, trees)
+    
+    # trees sorted by the smallest element of their orbit
+    trees.sort(key=lambda s: tree_key(minima[s]))
+    keys = [tree_key(minima[s]) for s in trees]
     
-    X = leaf_set(t)
-    for r in all_trees(X):
-        normal_pairs.add(normalize_tuple((t,r)))
+    for r in trees:
+        if minima[r] != r:
+            continue
+        
+        stabilizer = [sigma for sigma in G if apply_permutation(r, sigma) == r]
         
-        for s in all_trees(X):
-            normal_triples.add(normalize_tuple((t,r,s)))
+        # (t,s,r) is smaller than (t,r,s) if some image of s is smaller than r
+        for s in trees[bisect.bisect_left(keys, tree_key(r)):]:
+            key = tree_key(s)
+            if len(stabilizer) > 1 and any(_apply_permutation(s, sigma)[0] < key for sigma in stabilizer):
+                # s is not the smallest in its orbit under the stabilizer of r
+                continue
+            
+            if minima[s] == r and any(apply_permutation(s, sigma) == r and _apply_permutation(r, sigma)[0] < key for sigma in G):
+                # exchanging r and s gives a smaller triple
+                continue
+            
+            yield (t,r,s)
+
+
+TREE_IDS = Memo('TREE_IDS')
+def tree_ids(X):
+    """
+    IDs of all trees on leaf set X, i.e. their positions in the sorted list of trees.
+    """
+    X = tuple(X)
+    if X not in TREE_IDS:
+        TREE_IDS[X] = {t: i for i, t in enumerate(all_trees(X))}
     
-    sys.stdout.write(".")
-    sys.stdout.flush()
-    return normal_pairs, normal_triples
+    return TREE_IDS[X]
 
 
-def find_normal_forms(X, processes=1):
+def write_normal_tuples(args):
     """
-    Find normal forms for all trees, pairs and triples.
-    Return sorted lists of normal forms.
+    Find normal forms for all pairs and triples that begin with the normal tree t, and write
+    them to two new files in the given directory, as sorted rows of tree IDs (see tree_ids)
+    in arrays with the given typecode (only pairs of binary trees, and triples whose last two
+    trees are binary, if binary is True).
+    Return the ID of t and the paths of the files.
     """
-    normal_trees = set()
-    normal_pairs = set()
-    normal_triples = set()
+    t, directory, typecode, binary = args
+    ids = tree_ids(leaf_set(t))
     
-    for t in all_trees(X):
-        normal_trees.add(normalize_tree(t))
+    paths = []
+    for tuples in [generate_normal_pairs(t, binary=binary), generate_normal_triples(t, binary=binary)]:
+        data = array(typecode)
+        for row in sorted(set(tuple(ids[s] for s in tup) for tup in tuples)):
+            data.extend(row)
+        
+        fd, path = tempfile.mkstemp(dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            data.tofile(f)
+        paths.append(path)
     
-    if processes == 1:
-        results = [find_normal_tuples(t) for t in normal_trees]
-    else:
-        process_pool = Pool(processes=processes)
-        results = process_pool.map_async(find_normal_tuples, sorted(normal_trees, key=lambda t: len(t))).get(9999999)
+    return ids[t], paths[0], paths[1]
+
+
+def find_encoded_normal_forms(X, processes=1, typecode='I', binary=False):
+    """
+    Find normal forms for all trees, pairs and triples, as sorted rows of tree IDs (see tree_ids)
+    in three flat arrays with the given typecode.
+    If binary is True, only the pairs of binary trees and the triples (t,r,s) where r and s are
+    binary are found (the profiles of binary trees, with any consensus tree t); the pairs and
+    triples of the other trees are never built.
+    The normal pairs and triples that begin with each normal tree are found by a worker process, and
+    written to temporary files; since they begin with different trees, the results are merged by
+    concatenating the files in the order of the first tree.
+    """
+    ids = tree_ids(X)
+    normal_trees = sorted(set(ids[normalize_tree(t)] for t in all_trees(X)))
+    trees = sorted(ids, key=ids.get)
     
-    for pairs, triples in results:
-        normal_pairs |= pairs
-        normal_triples |= triples
+    directory = tempfile.mkdtemp()
+    process_pool = None
+    try:
+        tasks = [(trees[i], directory, typecode, binary) for i in sorted(normal_trees, key=lambda i: len(trees[i]))]
+        if processes == 1:
+            results = map(write_normal_tuples, tasks)
+        else:
+            process_pool = Pool(processes=processes)
+            results = process_pool.imap_unordered(write_normal_tuples, tasks, chunksize=max(1, len(tasks) // (4 * processes)))
+        
+        files = []
+        instrumentation.progress(0, len(tasks))
+        for res in results:
+            files.append(res)
+            instrumentation.progress(len(files), len(tasks))
+            sys.stdout.write(".")
+            sys.stdout.flush()
+        files.sort()
+        
+        normal_pairs = array(typecode)
+        normal_triples = array(typecode)
+        for i, pairs_path, triples_path in files:
+            for data, path in [(normal_pairs, pairs_path), (normal_triples, triples_path)]:
+                with open(path, 'rb') as f:
+                    data.fromfile(f, os.path.getsize(path) // data.itemsize)
+    finally:
+        if process_pool is not None:
+            process_pool.terminate()
+        shutil.rmtree(directory)
     
-    return list(sorted(normal_trees)), list(sorted(normal_pairs)), list(sorted(normal_triples))
+    return array(typecode, normal_trees), normal_pairs, normal_triples
 
 
+def find_normal_forms(X, processes=1, binary=False):
+    """
+    Find normal forms for all trees, pairs and triples (see find_encoded_normal_forms).
+    Return sorted lists of normal forms.
+    """
+    trees = list(all_trees(X))
+    normal_trees, normal_pairs, normal_triples = find_encoded_normal_forms(X, processes=processes, binary=binary)
+    return [trees[i] for i in normal_trees], \
+        [(trees[normal_pairs[j]], trees[normal_pairs[j+1]]) for j in range(0, len(normal_pairs), 2)], \
+        [(trees[normal_triples[j]], trees[normal_triples[j+1]], trees[normal_triples[j+2]]) for j in range(0, len(normal_triples), 3)]
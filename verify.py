@@ -0,0 +1,182 @@
+"""
+Independent verification of the certificates written by the programs (see certificate.py).
+
+The consensus method of a certificate is expanded to all the profiles (pairs of trees on
+subsets of X), and its properties are checked directly on them, using only tree.py:
+- for associative.py, the consensus of every pair of trees on X is defined, and it is
+  idempotent, commutative, associative (so it is the meet of a partial order) and Pareto
+  on rooted triples;
+- for extension.py, the consensus of every pair of binary trees on every leaf set Y of
+  at least 3 leaves is defined, and it is unanimous and extension stable.
+Since every triple of the certificate is expanded to its whole orbit, the consensus method
+is regular if there are no conflicts.
+Every check generates its counterexamples.
+"""
+
+import sys
+import time
+import argparse
+import itertools
+from collections import OrderedDict
+
+from tree import *
+from certificate import read_certificate, expand
+
+
+def restriction_table(trees, subsets):
+    """
+    Restrictions of the given trees to the given subsets of leaves, by pairs (tree, subset).
+    """
+    return {(t, Y): restriction(t, Y) for t in trees for Y in subsets}
+
+
+def check_defined(consensus, trees):
+    """
+    Pairs of trees whose consensus is not defined, or is not a tree on the same leaf set.
+    """
+    for r in trees:
+        for s in trees:
+            t = consensus.get((r,s))
+            if t is None or leaf_set(t) != leaf_set(r):
+                yield (r, s)
+
+
+def check_unanimity(consensus, trees):
+    """
+    Trees r such that the consensus of r and r is not r.
+    """
+    for r in trees:
+        if consensus[r,r] != r:
+            yield (r,)
+
+
+def check_commutativity(consensus, trees):
+    """
+    Pairs of trees (r,s) whose consensus is not the consensus of (s,r).
+    """
+    for r, s in itertools.combinations(trees, 2):
+        if consensus[r,s] != consensus[s,r]:
+            yield (r, s)
+
+
+def check_associativity(consensus, trees):
+    """
+    Triples of trees (a,b,d) such that (a^b)^d is not a^(b^d).
+    Since the consensus method is regular, only the triples where a is a normal tree are checked:
+    a counterexample (a,b,d) gives the counterexamples in its orbit.
+    """
+    for a in trees:
+        if normalize_tree(a) != a:
+            continue
+        for b in trees:
+            ab = consensus[a,b]
+            for d in trees:
+                if consensus[ab,d] != consensus[a,consensus[b,d]]:
+                    yield (a, b, d)
+
+
+def check_pareto_on_triples(consensus, trees, X):
+    """
+    Pairs of trees (r,s) and subsets Y of three leaves such that r and s have the same binary
+    restriction to Y, but their consensus does not.
+    """
+    subsets = list(itertools.combinations(X, 3))
+    restrictions = restriction_table(trees, subsets)
+    for r in trees:
+        for s in trees:
+            t = consensus[r,s]
+            for Y in subsets:
+                u = restrictions[r,Y]
+                if is_binary(u) and restrictions[s,Y] == u and restrictions[t,Y] != u:
+                    yield (r, s, Y)
+
+
+def check_extension_stability(consensus, trees, Y):
+    """
+    Pairs of trees (r,s) on Y and subsets Z of Y such that r|Z ^ s|Z <= (r ^ s)|Z does not hold,
+    where ^ is the consensus.
+    """
+    subsets = [Z for k in range(3, len(Y)) for Z in itertools.combinations(Y, k)]
+    restrictions = restriction_table(set(trees) | set(consensus[r,s] for r in trees for s in trees), subsets)
+    for r in trees:
+        for s in trees:
+            t = consensus[r,s]
+            for Z in subsets:
+                if not compare(consensus[restrictions[r,Z], restrictions[s,Z]], restrictions[t,Z]):
+                    yield (r, s, Z)
+
+
+def verify(program, n, triples):
+    """
+    Check the consensus method given by the triples of a certificate.
+    Return an ordered dictionary from the names of the checks to the number of their
+    counterexamples and the first one (None if there are none).
+    """
+    X = list(range(1, n+1))
+    consensus, conflicts = expand(triples, X)
+    
+    if program == 'associative':
+        domains = [list(all_trees(X))]
+    else:
+        domains = [list(all_trees(Y, binary=True)) for k in range(3, n+1) for Y in itertools.combinations(X, k)]
+    
+    results = OrderedDict()
+    results['conflicts'] = count_counterexamples(conflicts)
+    results['defined'] = count_counterexamples(itertools.chain.from_iterable(check_defined(consensus, trees) for trees in domains))
+    if any(count > 0 for count, first in results.values()):
+        # the other checks need the consensus of every pair
+        return results
+    
+    if program == 'associative':
+        trees = domains[0]
+        results['unanimity'] = count_counterexamples(check_unanimity(consensus, trees))
+        results['commutativity'] = count_counterexamples(check_commutativity(consensus, trees))
+        results['associativity'] = count_counterexamples(check_associativity(consensus, trees))
+        results['pareto_on_triples'] = count_counterexamples(check_pareto_on_triples(consensus, trees, X))
+    else:
+        results['unanimity'] = count_counterexamples(itertools.chain.from_iterable(check_unanimity(consensus, trees) for trees in domains))
+        results['extension_stability'] = count_counterexamples(itertools.chain.from_iterable(check_extension_stability(consensus, trees, leaf_set(trees[0])) for trees in domains))
+    return results
+
+
+def count_counterexamples(counterexamples):
+    """
+    Number of counterexamples, and the first one (None if there are none).
+    """
+    count = 0
+    first = None
+    for counterexample in counterexamples:
+        if count == 0:
+            first = counterexample
+        count += 1
+    return count, first
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Check the consensus method of a certificate written by associative.py or extension.py.')
+    
+    parser.add_argument('certificate', help='certificate file (written with --certificate)')
+    args = parser.parse_args()
+    
+    
+    program, n, triples = read_certificate(args.certificate)
+    X = list(range(1, n+1))
+    print("Certificate of %s.py for X = %r" % (program, X))
+    if triples is None:
+        print("It states that there is no valid consensus method, which cannot be checked without the model")
+        sys.exit(2)
+    
+    print("Check the consensus method given by %d normal triples" % len(triples))
+    start = time.time()
+    results = verify(program, n, triples)
+    for name, (count, first) in results.items():
+        if count == 0:
+            print("  %s: OK" % name)
+        else:
+            print("  %s: %d counterexamples, e.g. %r" % (name, count, first))
+    print("Checked in %.1f seconds" % (time.time() - start))
+    
+    if any(count > 0 for count, first in results.values()):
+        print("The certificate is NOT valid")
+        sys.exit(1)
+    print("The certificate is valid")